@@ -75,6 +75,13 @@ bool sleepstate = true;
 #define TYPE_SPI_DAC 0x01
 #define TYPE_DIGITAL 0x02
 
+// packet protocol: sync byte, number of entries, entries of command byte and
+// two data bytes (little endian), checksum (sum of count and entry bytes)
+#define PROTOCOL_VERSION 2 // reported on request 3, tells Spotter packets are understood
+#define PACKET_SYNC 0xA5 // never a valid legacy command byte (type 4)
+#define PACKET_MAX_PINS 16
+byte packet[3 * PACKET_MAX_PINS];
+
 int inData = 0;
 byte outData = 0;
 
@@ -165,6 +172,9 @@ void report(byte request, short inputValue) {
     case 0x02:
       Serial.println(DOUT_N, DEC);
       break;
+    case 0x03:
+      Serial.println(PROTOCOL_VERSION, DEC);
+      break;
   }
 }
 
@@ -264,25 +274,67 @@ void setup() {
   initPins();
 }
 
+/*
+  Wait for the next byte on the serial port
+*/
+byte readByte() {
+  do {
+    tmp = Serial.read();
+  } while (tmp < 0);
+  return tmp;
+}
+
+/*
+  Read the rest of a packet after its sync byte. Entries are only executed
+  if the checksum matches, a corrupted packet is dropped as a whole. Packets
+  with more entries than fit are read to their end and dropped, so the
+  following bytes are not taken for legacy commands.
+*/
+void readPacket() {
+  byte n = readByte();
+  if (n > PACKET_MAX_PINS) {
+    DEBUGLN("packet too long");
+    for (int i = 0; i < 3 * n + 1; i++) {
+      readByte();
+    }
+    return;
+  }
+  byte checksum = n;
+  for (byte i = 0; i < 3 * n; i++) {
+    packet[i] = readByte();
+    checksum += packet[i];
+  }
+  if (readByte() != checksum) {
+    DEBUGLN("checksum mismatch");
+    return;
+  }
+  for (byte i = 0; i < n; i++) {
+    inBytes[0] = packet[3 * i];
+    inBytes[1] = packet[3 * i + 1];
+    inBytes[2] = packet[3 * i + 2];
+    inBytes[3] = '\n';
+    interpretCommand();
+  }
+}
+
 /*
   Called when serial data available after each loop()
   Requires use of non-blocking timings for opening outputs,
   otherwise delayed and buffers might fill up
 
-  Current protocol is defined as one command byte, followed
-  by two data bytes and closed with a newline.
+  Two protocols are understood. Legacy: one command byte, followed
+  by two data bytes and closed with a newline. Packets: starting with
+  PACKET_SYNC, see readPacket.
 */
-//Nora's changes: this function was left unchanged
 void serialEvent() {
   while (Serial.available()) {
-    byte n = 0;
-    while (n < 4) {
-      // get the new byte:
-      tmp = Serial.read();
-      if (tmp > -1) {
-        inBytes[n] = tmp;
-        n++;
-      }
+    inBytes[0] = readByte();
+    if (inBytes[0] == PACKET_SYNC) {
+      readPacket();
+      continue;
+    }
+    for (byte n = 1; n < 4; n++) {
+      inBytes[n] = readByte();
     }
     interpretCommand();
   }
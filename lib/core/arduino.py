@@ -6,7 +6,6 @@ Created on Sat Jan  5 16:54:29 2013
 
 A lot of the handling is done the way Firmata handles the boards
 
-TODO: How does the non-blocking pass_time function work exactly?
 """
 import logging
 
@@ -17,20 +16,42 @@ import struct
 
 VERSION = 0.1
 
+PROTOCOL = 'auto'       # 'auto' uses packets if the firmware reports support, 'legacy' never does
+PACKET_VERSION = 2      # firmware protocol version (report 3) that understands packets
+PACKET_SYNC = 0xA5      # first byte of a packet, never a valid legacy command byte
+PACKET_MAX_PINS = 16    # pin updates per packet, longer updates are split; must
+                        # not exceed the firmware's, which drops longer packets
+PACKET_MIN_PINS = 4     # fewer changed pins go out as legacy instructions, a packet
+                        # takes 3 + 3n bytes against 4n and is only shorter from n = 4
+REFRESH_INTERVAL = 0.1  # seconds after which unchanged values are sent again
+                        # the firmware zeroes DACs not updated for ~200 ms
+
+# command byte base by instruction type: report, dac, digital
+CMD_VALUES = [0, ord('H'), ord('P')]
+# legacy instruction: command, data (uint16), newline
+LEGACY_INSTRUCTION = struct.Struct('<BHB')
+# packet entry: command, data (uint16)
+PACKET_ENTRY = struct.Struct('<BH')
+
 
 class Pin(object):
     prefixes = ['CMD', 'DAC', 'DO', 'PWM']
     types = ['report', 'dac', 'digital', 'pwm']
 
     def __init__(self, idx, type_id):
-        self.id = idx
         self.type_id = type_id
         self.type = self.types[type_id]
-        self.label = ''.join([self.prefixes[type_id], '.', str(idx)])
+        # address on the board, id and label in the namespace of all boards
+        self.addr = idx
+        self.renumber(idx)
 
         self.slot = None
         self.available = True
 
+    def renumber(self, idx):
+        self.id = idx
+        self.label = ''.join([self.prefixes[self.type_id], '.', str(idx)])
+
 
 class Arduino(object):
     firmware_version = None
@@ -50,6 +71,14 @@ class Arduino(object):
         self.pins = dict(dac=[], digital=[], pwm=[], adc=[])
 
         self.port_string = port
+
+        self.protocol = 'legacy'
+        # last value sent per (type, pin), for skipping unchanged values
+        self.sent = {}
+        self.last_refresh = 0
+        # preallocated output buffers
+        self.legacy_buffer = bytearray(LEGACY_INSTRUCTION.size * 2 * PACKET_MAX_PINS)
+        self.packet_buffer = bytearray(3 + PACKET_ENTRY.size * PACKET_MAX_PINS)
 #        self.sp.flushInput()
 
     def __str__(self):
@@ -99,10 +128,78 @@ class Arduino(object):
     def send_as_two_bytes(self, val):
         self.sp.write(chr(val % 128) + chr(val >> 7))
 
+    def detect_protocol(self, mode=PROTOCOL):
+        """ Ask the firmware for its protocol version (report 3). Firmware
+        without packet support does not answer, and stays on legacy.
+        """
+        self.protocol = 'legacy'
+        if mode == 'legacy':
+            return self.protocol
+        self.send_instructions([[0, 3, 0]])
+        self.pass_time(0.1)
+        if self.bytes_available():
+            try:
+                version = int(self.read_all_bytes().split()[0])
+            except (ValueError, IndexError):
+                version = 0
+            if version >= PACKET_VERSION:
+                self.protocol = 'packet'
+        self.log.info('Using %s serial protocol', self.protocol)
+        return self.protocol
+
+    def send_updates(self, instruction_list):
+        """
+        Send only values that changed since they were last sent, with the
+        protocol the firmware understands, as packets only when at least
+        PACKET_MIN_PINS values changed. All values are sent again every
+        REFRESH_INTERVAL seconds, so outputs are kept alive.
+        """
+        now = time.time()
+        if now - self.last_refresh >= REFRESH_INTERVAL:
+            self.last_refresh = now
+            changed = instruction_list
+        else:
+            sent = self.sent
+            changed = [i for i in instruction_list if sent.get((i[0], i[1])) != i[2]]
+        if not changed:
+            return True
+
+        if self.protocol == 'packet' and len(changed) >= PACKET_MIN_PINS:
+            ok = self.send_packet(changed)
+        else:
+            ok = self.send_instructions(changed)
+        if ok:
+            for i in changed:
+                self.sent[(i[0], i[1])] = i[2]
+        return ok
+
+    def send_packet(self, instruction_list):
+        """
+        Send instructions as framed packets of up to PACKET_MAX_PINS entries:
+        sync byte, number of entries, entries of command byte and two data
+        bytes (little endian), checksum. The checksum is the sum of the count
+        and entry bytes, modulo 256. A packet never carries more than
+        PACKET_MAX_PINS entries, longer lists always go out split.
+        """
+        buf = self.packet_buffer
+        for start in xrange(0, len(instruction_list), PACKET_MAX_PINS):
+            part = instruction_list[start:start + PACKET_MAX_PINS]
+            buf[0] = PACKET_SYNC
+            buf[1] = len(part)
+            offset = 2
+            for i in part:
+                data = i[2] if i[2] is not None else 0
+                PACKET_ENTRY.pack_into(buf, offset, CMD_VALUES[i[0]] + i[1], data)
+                offset += PACKET_ENTRY.size
+            buf[offset] = sum(buf[1:offset]) & 0xFF
+            if not self.write(buf[:offset + 1]):
+                return False
+        return True
+
     def send_instructions(self, instruction_list):
         """
         Send command byte followed by two data bytes. struct packs short
-        unsigned value ('H') as two bytes, big endian.
+        unsigned value ('H') as two bytes, little endian.
         Type 0 = report
         Type 1 = dac
         Type 2 = digital
@@ -118,21 +215,26 @@ class Arduino(object):
         N DAC.6     V DO.6
         O DAC.7     W DO.7
         """
-        msg = ''
-        cmd_values = [0, ord('H'), ord('P')]
+        size = LEGACY_INSTRUCTION.size * len(instruction_list)
+        if size > len(self.legacy_buffer):
+            self.legacy_buffer = bytearray(size)
+        buf = self.legacy_buffer
+        offset = 0
         for i in instruction_list:
             # instruction and address
-            msg += chr(cmd_values[i[0]] + i[1])
             data = i[2] if i[2] is not None else 0
-            msg = msg + struct.pack('H', data) + '\n'
+            LEGACY_INSTRUCTION.pack_into(buf, offset, CMD_VALUES[i[0]] + i[1], data, 10)
+            offset += LEGACY_INSTRUCTION.size
 
         # all instructions as one string to reduce the amount of
         # time spent in 4ms delay arduino spends on serial communication
+        return self.write(buf[:offset])
+
+    def write(self, msg):
         if self.sp is None:
             return False
         try:
             self.sp.write(msg)
-			#self.log.info("sending message")
         except serial.serialutil.SerialTimeoutException, error:  # or writeTimeoutError
             self.log.error(error)
             self.sp = None
@@ -157,15 +259,15 @@ class Arduino(object):
             instr = []
             for pin_key in self.pins.iterkeys():
                 for p in self.pins[pin_key]:
-                    instr.append([p.type_id, p.id, 0])
+                    instr.append([p.type_id, p.addr, 0])
             self.send_instructions(instr)
 
     @staticmethod
     def pass_time(duration):
-        """ Non-blocking time-out for t seconds. """
-        cont = time.time() + duration
-        while time.time() < cont:
-            time.sleep(0)
+        """ Time-out for t seconds. Sleeps, so other threads (e.g. probes of
+        other ports, the GUI) keep running meanwhile.
+        """
+        time.sleep(duration)
 
 
 #############################################################
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar, chunked binary data log.
+
+Rows (one per logged frame) are collected into chunks. Each chunk stores its
+columns back to back, every column a fixed-width typed array, so reading is a
+matter of pointing numpy at the memory mapped file. Missing values are NaN.
+
+File layout:
+    MAGIC, header length (uint32), JSON header (padded to 8 bytes)
+    chunk header, column 0, column 1, ... column n
+    chunk header, column 0, ...
+    index, trailer (written on close)
+
+The index holds one entry per chunk (offset, tickstamp and frame range), so
+range queries are a binary search instead of a scan. Files without index,
+e.g. after a crash, are indexed by walking the chunk headers on opening.
+
+Chunks can be compressed (zlib or bz2, named in the header). Every chunk is
+compressed on its own, so chunks stay independently readable and seeking
+works as before. Compression runs on the thread calling write_batch, for the
+DataLogger that is its background thread.
+
+Reading back:
+    log = ColumnarLog('session.splog')
+    data = log.read(['mouse.x', 'mouse.y'], t_start=60000, t_stop=120000)
+    for part in log.iter_chunks(['mouse.x'], t_start=60000, t_stop=120000):
+        ...
+"""
+
+import bz2
+import zlib
+import json
+import mmap
+import struct
+import logging
+
+import numpy as np
+
+MAGIC = 'SPTLOG01'
+EXTENSION = '.splog'
+CHUNK_ROWS = 1024
+COMPRESSION = 'zlib'     # codec used when compressing chunks, 'zlib' or 'bz2'
+COMPRESSION_LEVEL = 6    # 0 stores chunks uncompressed, 1 (fast) - 9 (small)
+
+# codec name -> (compress(data, level), decompress(data))
+CODECS = {'zlib': (zlib.compress, zlib.decompress),
+          'bz2': (bz2.compress, bz2.decompress)}
+
+# tag, rows, stored bytes, raw bytes, first/last tickstamp, first/last frame index
+CHUNK_HEADER = struct.Struct('<4sIIIqqqq')
+CHUNK_TAG = 'CHNK'
+
+OBJECT_FIELDS = ('x', 'y', 'speed', 'orientation')
+LED_FIELDS = ('x', 'y')
+
+# index offset, number of entries, fields per entry, tag
+INDEX_TRAILER = struct.Struct('<QII4s')
+INDEX_TAG = 'SIDX'
+# fields of a chunk index entry, all int64
+INDEX_FIELDS = ('offset', 'n_rows', 'n_bytes', 'raw_bytes', 't_first', 't_last', 'i_first', 'i_last')
+
+NAN = float('nan')
+
+
+def _value(v):
+    return NAN if v is None else v
+
+
+def _pad(n, alignment=8):
+    return (alignment - n % alignment) % alignment
+
+
+def write_index(f, entries, n_fields):
+    """ Append a sparse index (list of tuples of ints) and its trailer to an open file. """
+    offset = f.tell()
+    index = np.array(entries, '<i8').reshape(-1, n_fields)
+    f.write(index.tostring())
+    f.write(INDEX_TRAILER.pack(offset, len(index), n_fields, INDEX_TAG))
+
+
+def read_index(buf):
+    """
+    Sparse index from the end of a file (mmap or string). Returns the index
+    as (n, fields) int64 array and the offset at which it starts, which is
+    the end of the data. (None, len(buf)) if the file has no index.
+    """
+    end = len(buf)
+    if end < INDEX_TRAILER.size:
+        return None, end
+    offset, n, n_fields, tag = INDEX_TRAILER.unpack_from(buf, end - INDEX_TRAILER.size)
+    if tag != INDEX_TAG or offset + n * n_fields * 8 != end - INDEX_TRAILER.size:
+        return None, end
+    return np.frombuffer(buf, '<i8', n * n_fields, offset).reshape(n, n_fields), offset
+
+
+class ColumnarLogWriter:
+    """
+    Append-only writer, interface shared with the text log of the DataLogger.
+    The column layout is fixed on creation: frame index, tickstamp, then for
+    every object and LED its fields as float32 columns named label.field.
+    """
+    extension = EXTENSION
+
+    def __init__(self, destination, objects, leds, chunk_rows=CHUNK_ROWS,
+                 compression=COMPRESSION_LEVEL, codec=COMPRESSION, **info):
+        self.log = logging.getLogger(__name__)
+        self.destination = destination
+        self.objects = list(objects)
+        self.leds = list(leds)
+        self.chunk_rows = chunk_rows
+        self.level = compression
+        self.codec = codec if compression else None
+        self.compress = CODECS[codec][0] if compression else None
+
+        self.columns = [('index', '<i8'), ('tickstamp', '<i8')]
+        for o in self.objects:
+            self.columns.extend(('%s.%s' % (o.label, f), '<f4') for f in OBJECT_FIELDS)
+        for l in self.leds:
+            self.columns.extend(('%s.%s' % (l.label, f), '<f4') for f in LED_FIELDS)
+
+        # chunk buffer, one preallocated array per column
+        self.buffers = [np.empty(chunk_rows, dtype) for _, dtype in self.columns]
+        self.n_rows = 0
+        self.index = []
+
+        header = dict(info)
+        header.update({'columns': self.columns, 'chunk_rows': chunk_rows,
+                       'compression': self.codec})
+        header = json.dumps(header)
+        header += ' ' * _pad(len(MAGIC) + 4 + len(header))
+
+        self.file = open(destination, 'wb')
+        self.file.write(MAGIC)
+        self.file.write(struct.pack('<I', len(header)))
+        self.file.write(header)
+
+    def snapshot(self, frame, objects):
+        """ Row of values for the current frame, taken on the tracking thread. """
+        row = [frame.index, frame.tickstamp]
+        for o in self.objects:
+            row.extend((_value(o.getPositionX()), _value(o.getPositionY()),
+                        _value(o.getSpeed()), _value(o.getOrientation())))
+        for l in self.leds:
+            p = l.position
+            row.extend((NAN, NAN) if p is None else (p[0], p[1]))
+        return row
+
+    def write_batch(self, batch):
+        for row in batch:
+            i = self.n_rows
+            for buf, v in zip(self.buffers, row):
+                buf[i] = v
+            self.n_rows += 1
+            if self.n_rows == self.chunk_rows:
+                self.write_chunk()
+
+    def write_chunk(self):
+        n = self.n_rows
+        if not n:
+            return
+        payload = ''.join(buf[:n].tostring() for buf in self.buffers)
+        raw_bytes = len(payload)
+        if self.compress is not None:
+            # chunks that do not shrink are stored raw, stored == raw bytes
+            packed = self.compress(payload, self.level)
+            if len(packed) < raw_bytes:
+                payload = packed
+        index, tickstamp = self.buffers[0], self.buffers[1]
+        fields = (n, len(payload), raw_bytes, tickstamp[0], tickstamp[n-1], index[0], index[n-1])
+        self.file.write(CHUNK_HEADER.pack(CHUNK_TAG, *fields))
+        self.index.append((self.file.tell(), ) + fields)
+        self.file.write(payload)
+        self.n_rows = 0
+
+    def flush(self):
+        """ Chunks are only written complete, a partial chunk stays buffered. """
+        self.file.flush()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.write_chunk()
+        write_index(self.file, self.index, len(INDEX_FIELDS))
+        self.file.close()
+        self.file = None
+        self.log.debug("Closed %s with %d chunks", self.destination, len(self.index))
+
+
+class ColumnarLog:
+    """ Memory mapped reader. Only chunk headers are parsed on opening. """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise IOError("Not a Spotter data log")
+        n_header = struct.unpack_from('<I', self.mm, len(MAGIC))[0]
+        start = len(MAGIC) + 4
+        self.header = json.loads(self.mm[start:start+n_header])
+        self.columns = [(str(name), str(dtype)) for name, dtype in self.header['columns']]
+        self.names = [name for name, _ in self.columns]
+        codec = self.header.get('compression')
+        self.decompress = CODECS[codec][1] if codec else None
+        # last decompressed chunk, (number, data)
+        self.cached = (None, None)
+
+        index, data_end = read_index(self.mm)
+        if index is None:
+            index = self.scan_chunks(start + n_header, data_end)
+        # one array per index field, e.g. self.chunks['t_first']
+        self.chunks = dict((f, index[:, i]) for i, f in enumerate(INDEX_FIELDS))
+
+    def scan_chunks(self, offset, end):
+        """ Build the chunk index by walking all chunk headers. """
+        entries = []
+        while offset + CHUNK_HEADER.size <= end:
+            fields = CHUNK_HEADER.unpack_from(self.mm, offset)
+            if fields[0] != CHUNK_TAG:
+                break
+            offset += CHUNK_HEADER.size
+            if offset + fields[2] > end:
+                break  # truncated last chunk
+            entries.append((offset, ) + fields[1:])
+            offset += fields[2]
+        return np.array(entries, np.int64).reshape(-1, len(INDEX_FIELDS))
+
+    def __len__(self):
+        return int(self.chunks['n_rows'].sum())
+
+    @property
+    def n_chunks(self):
+        return len(self.chunks['offset'])
+
+    def chunk_data(self, k):
+        """ Buffer and offset of the raw columns of chunk k. Uncompressed
+        chunks are read straight from the file, compressed ones are
+        decompressed into memory.
+        """
+        offset = int(self.chunks['offset'][k])
+        n_bytes = int(self.chunks['n_bytes'][k])
+        if self.decompress is None or n_bytes == self.chunks['raw_bytes'][k]:
+            return self.mm, offset
+        if self.cached[0] != k:
+            self.cached = (k, self.decompress(self.mm[offset:offset+n_bytes]))
+        return self.cached[1], 0
+
+    def chunk_columns(self, k, names):
+        """ Dict of column arrays of chunk k, views into the file or into
+        the decompressed chunk.
+        """
+        out = {}
+        n_rows = int(self.chunks['n_rows'][k])
+        buf, offset = self.chunk_data(k)
+        for name, dtype in self.columns:
+            dtype = np.dtype(dtype)
+            if name in names:
+                out[name] = np.frombuffer(buf, dtype, n_rows, offset)
+            offset += dtype.itemsize * n_rows
+        return out
+
+    def chunk_range(self, start=None, stop=None, by='t'):
+        """
+        Indices (first, last+1) of the chunks overlapping [start, stop), by
+        tickstamp ('t') or frame index ('i'). Binary search on the index.
+        """
+        first, last = self.chunks[by + '_first'], self.chunks[by + '_last']
+        lo = 0 if start is None else int(np.searchsorted(last, start, 'left'))
+        hi = len(first) if stop is None else int(np.searchsorted(first, stop, 'left'))
+        return lo, max(lo, hi)
+
+    def iter_chunks(self, names=None, start=None, stop=None, by='t'):
+        """
+        Stream the rows with start <= tickstamp (or frame index) < stop chunk
+        by chunk, as dicts of column arrays. Keeps memory use flat for very
+        long sessions.
+        """
+        if names is None:
+            names = self.names
+        key = 'tickstamp' if by == 't' else 'index'
+        wanted = set(names) | set([key])
+        lo, hi = self.chunk_range(start, stop, by)
+        for k in xrange(lo, hi):
+            data = self.chunk_columns(k, wanted)
+            if (start is not None and k == lo) or (stop is not None and k == hi - 1):
+                mask = np.ones(len(data[key]), bool)
+                if start is not None:
+                    mask &= data[key] >= start
+                if stop is not None:
+                    mask &= data[key] < stop
+                data = dict((name, data[name][mask]) for name in wanted)
+            yield dict((name, data[name]) for name in names)
+
+    def read(self, names=None, t_start=None, t_stop=None):
+        """
+        Return dict of column name -> array for all rows with
+        t_start <= tickstamp < t_stop. Without range, the whole log.
+        """
+        return self._collect(names, self.iter_chunks(names, t_start, t_stop, 't'))
+
+    def read_frames(self, i_start=None, i_stop=None, names=None):
+        """ Like read, but by frame index range. """
+        return self._collect(names, self.iter_chunks(names, i_start, i_stop, 'i'))
+
+    def _collect(self, names, parts):
+        if names is None:
+            names = self.names
+        parts = list(parts)
+        if not parts:
+            return dict((name, np.empty(0, dict(self.columns)[name])) for name in names)
+        if len(parts) == 1:
+            return parts[0]
+        return dict((name, np.concatenate([p[name] for p in parts])) for name in names)
+
+    def close(self):
+        self.cached = (None, None)
+        self.mm.close()
+        self.file.close()
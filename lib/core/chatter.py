@@ -30,13 +30,19 @@ To do:
 import sys
 import time
 import logging
+import threading
 from random import randint
 
+import numpy as np
+
 import lib.utilities as utils
 import lib.geometry as geom
 from lib.docopt import docopt
 
 from lib.core import arduino
+from lib.core import serialout
+from lib.core import scheduler
+from lib.core import slottable
 
 
 #TODO:
@@ -46,15 +52,82 @@ from lib.core import arduino
 #    - define data protocol (i.e. RS232 like?)
 
 N_TRIES = 2
+PROBE_TIMEOUT = 8.0  # seconds a port gets to reset the board and answer the handshake
+OUTPUT_RATE = None   # Hz of the fixed-rate output scheduler, None sends once per frame
+MAX_BOARDS = 4       # boards connected at most, all answering ports up to this number are used
+
+
+class Board:
+    """ One connected device with its own output thread (and scheduler).
+    Updates are posted without waiting, so each board writes in parallel.
+    """
+
+    def __init__(self, device, port, output_rate=None, max_value=4095):
+        self.device = device
+        self.port = port
+        self.output = serialout.SerialOutput(device, name='SerialOutput %s' % port).start()
+        self.scheduler = None
+        if output_rate:
+            self.scheduler = scheduler.OutputScheduler(self.output, output_rate, max_value=max_value).start()
+
+    def __str__(self):
+        return str(self.device)
+
+    @property
+    def failed(self):
+        return self.output.failed
+
+    def post(self, instructions, extrapolate=None):
+        if self.scheduler is not None:
+            self.scheduler.update(instructions, extrapolate=extrapolate)
+        else:
+            self.output.post(instructions)
+
+    def all_pins(self):
+        return [p for pins in self.device.pins.itervalues() for p in pins]
+
+    def close(self):
+        # output threads have to be gone before the pins are nulled
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self.output.stop()
+        self.device.close()
+
+
+def merge_stats(stats):
+    """ Combine stat dicts of several boards: counters add up, means are
+    averaged, maxima and rates take the worst board.
+    """
+    stats = [st for st in stats if st]
+    if not stats:
+        return None
+    merged = {}
+    for key in stats[0]:
+        values = [st[key] for st in stats]
+        if key.startswith('n_'):
+            merged[key] = sum(values)
+        elif key.endswith('_max') or key.endswith('_std'):
+            merged[key] = max(values)
+        elif key == 'rate':
+            merged[key] = min(values)
+        else:
+            merged[key] = sum(values) / float(len(values))
+    return merged
 
 
 class Chatter:
-    serial_device = None
+    """ Output to one or more boards. Pins of all boards share one
+    namespace: pin ids of each type are numbered across boards in the order
+    of the ports they were found on, pin.addr is the address on its own
+    board. Ids of removed boards are not handed out again until all boards
+    are closed.
+    """
     serial_port = None
     label = 'Arduino Mega'
     connected = False
 
-    def __init__(self, port=4, frame_size=(639, 359), max_dac=4095, auto=False):
+    def __init__(self, port=4, frame_size=(639, 359), max_dac=4095, auto=False, block=True,
+                 output_rate=OUTPUT_RATE, max_boards=MAX_BOARDS):
 
         self.log = logging.getLogger(__name__)
 
@@ -66,53 +139,187 @@ class Chatter:
 #        print ('DAC factor: ' + str(self.factor_dac))
 #        print ('DAC offset: ' + str(self.offset_dac))
         self.range_dac = (dr, dr)
+        self.max_dac = max_dac
+        # x and y to DAC value as one affine transform per axis: positions
+        # centered in the square of the longer side, y flipped as the
+        # origin is the upper left corner
+        coord_max = max(frame_size)
+        self.dac_gain = np.array([self.factor_dac, -self.factor_dac])
+        self.dac_offset = np.array([(coord_max - frame_size[0]) / 2.0 * self.factor_dac + self.offset_dac,
+                                    (frame_size[1] + (coord_max - frame_size[1]) / 2.0) * self.factor_dac
+                                    + self.offset_dac])
+        self.output_rate = output_rate
+        self.max_boards = max_boards
+        self.boards = []
+        # next free pin id by pin type
+        self.next_pin_id = {}
+        # (pin type, pin label) -> slot detached when its board went away,
+        # bound again if a board brings back a pin of that label
+        self.released = {}
 
         self.auto = auto
+        # last value sent to each digital pin, by pin label
+        self.digital_states = {}
+        # slot -> pin bindings of lists of slots passed to update_pins
+        self.slot_table = slottable.SlotTable()
+
+        # port probing, a probe only takes over the connection if its
+        # session is still current
+        self.lock = threading.Lock()
+        self.probe_session = 0
+        self.connecting = False
 
         if port or auto:
             #CHECK ALL AVAILABLE PORTS FOR CONNECTION?
             # --> ON WINDOWS ALL, ON LINUX ONLY IF CANDIDATE!
-            self.auto_connect(port)
+            self.auto_connect(port, block)
 
-    def auto_connect(self, port=6):
+    def auto_connect(self, port=6, block=True):
         """
         Try to connect to specific port. If no port specified, try to connect
         to all ports on the port_list. If any of them replies correctly, stop
         and be happy about the connection!
+        All ports are probed at the same time, the first max_boards to
+        answer the handshake are connected. Without block, returns False
+        right away and the connection comes up in the background; until
+        then pin updates are skipped. port may also be a list of ports.
         """
+        self.close()
+        return self.add_ports(port, block)
+
+    def add_ports(self, port=None, block=True):
+        """ Connect further boards, keeping those already connected. """
         if port:
             if isinstance(port, basestring):
                 port_list = [(port, port)]
+            elif isinstance(port, list):
+                port_list = [(p, p) for p in port]
             else:
                 port_list = [port]
         else:
-            port_list = utils.get_port_list()
+            connected = [b.port for b in self.boards]
+            port_list = [p for p in utils.get_port_list() if p[1] not in connected]
+
+        self.connecting = True
+        if block:
+            return self.probe_ports(port_list, self.probe_session)
+        prober = threading.Thread(target=self.probe_ports, args=(port_list, self.probe_session),
+                                  name='PortProbe')
+        prober.daemon = True
+        prober.start()
+        return self.connected
 
-        for p in port_list:
-            try:
-                if self.open_serial(p[1]) and self.test_connection():
-                    self.serial_port = p[1]
-                    self.connected = True
-                    return self.connected
-            except Exception, e:
-                self.log.error(str(e))
-                self.log.error('Port is broken or handshake invalid')
-        self.connected = False
+    def probe_ports(self, port_list, session):
+        """ Probe all ports in parallel, wait until enough boards answered
+        or all probes failed or timed out. The boards that answered are
+        added in the order of port_list, whichever handshake finished first,
+        so pin ids do not change from run to run.
+        """
+        finished = threading.Event()
+        passed = {}
+        probes = []
+        for i, p in enumerate(port_list):
+            t = threading.Thread(target=self.probe, args=(p, i, passed, finished), name='Probe %s' % str(p))
+            t.daemon = True
+            t.start()
+            probes.append(t)
+
+        free = self.max_boards - len(self.boards)
+        deadline = time.time() + PROBE_TIMEOUT
+        while len(passed) < free and time.time() < deadline \
+                and any(t.is_alive() for t in probes):
+            time.sleep(0.05)
+
+        with self.lock:
+            # probes still running past the timeout can no longer connect
+            finished.set()
+            for i in sorted(passed):
+                device = passed[i]
+                if session == self.probe_session and len(self.boards) < self.max_boards:
+                    self.add_board(device, port_list[i][1])
+                else:
+                    device.close()
+
+        if session == self.probe_session:
+            self.connecting = False
+            if not self.connected:
+                self.log.warning('No device answered on %d port(s)', len(port_list))
         return self.connected
 
-    def open_serial(self, port):
-        self.close()
-        self.log.info("Opening port %s", port)
-        self.serial_device = arduino.Arduino(port)
-        if self.serial_device.is_open():
+    def probe(self, p, i, passed, finished):
+        """ Open port and test handshake, on success leave the device in
+        passed under i for probe_ports to add.
+        """
+        device = None
+        try:
+            self.log.info("Opening port %s", p[1])
+            device = arduino.Arduino(p[1])
+            if device.is_open() and self.test_connection(device=device):
+                with self.lock:
+                    if not finished.is_set():
+                        passed[i] = device
+                        return
+        except Exception, e:
+            self.log.error(str(e))
+            self.log.error('Port is broken or handshake invalid')
+        if device is not None:
+            device.close()
+
+    def add_board(self, device, port):
+        """ Take over a device that passed the handshake. Its pins are
+        numbered from the next free id of their type, slots released from
+        a pin of the same label are bound to it again.
+        """
+        for pin_type, pins in device.pins.iteritems():
+            offset = self.next_pin_id.get(pin_type, 0)
+            for p in pins:
+                p.renumber(offset + p.addr)
+            if pins:
+                self.next_pin_id[pin_type] = offset + max(p.addr for p in pins) + 1
+            for p in pins:
+                slot = self.released.pop((pin_type, p.label), None)
+                if slot is not None and slot.pin is None and p.slot is None:
+                    slot.attach_pin(p)
+        board = Board(device, port, self.output_rate, self.max_dac)
+        self.boards.append(board)
+        if self.serial_port is None or len(self.boards) == 1:
             self.serial_port = port
-        return self.serial_device.is_open()
+        self.connected = True
+        self.log.info("Connected to %s, %d board(s)", board, len(self.boards))
+        return board
 
-    def test_connection(self, test_values=None):
+    def remove_board(self, board):
+        """ Close a board and detach the slots of its pins. Pin ids of the
+        remaining boards stay as they are.
+        """
+        with self.lock:
+            self.boards.remove(board)
+            self.connected = bool(self.boards)
+        self.release_pins(board)
+        board.close()
+
+    def release_pins(self, board):
+        """ Detach the slots bound to pins of board, remembering the pin
+        labels they were bound to.
+        """
+        for p in board.all_pins():
+            self.digital_states.pop(p.label, None)
+            if p.slot is not None:
+                self.released[(p.type, p.label)] = p.slot
+                p.slot.detach_pin()
+
+    @property
+    def serial_device(self):
+        """ Device of the first board. """
+        return self.boards[0].device if self.boards else None
+
+    def test_connection(self, test_values=None, device=None):
         """
         Sends values from list test_values to Arduino and compares response.
         If no response or response not matching, the test fails.
         """
+        if device is None:
+            device = self.serial_device
         if not test_values:
             test_values = [0, self.range_dac[0], randint(0, 4095)]
         instructions = []
@@ -120,53 +327,72 @@ class Chatter:
             instructions.append([0, 0, v])
 
         for n in xrange(N_TRIES):
-            self.serial_device.send_instructions(instructions)
+            device.send_instructions(instructions)
             time.sleep(0.1)
-            if self.bytes_available():
-                if test_values == map(int, self.read_all().splitlines()):
-                    if self.serial_device.get_pins():
+            if device.bytes_available():
+                if test_values == map(int, device.read_all_bytes().splitlines()):
+                    if device.get_pins():
+                        device.detect_protocol()
                         return True
         return False
 
     def update_pins(self, slots):
-        """ instr: [type, instr, data, index]"""
+        """ Send the values of slots, a compiled slottable.SlotTable or a
+        list of slots (compiled here whenever it changes).
+        Values are handed to the output thread, the serial port is never
+        written from the calling thread. With a scheduler, they only update
+        the state the scheduler emits from at its own rate.
+        """
         if not self.connected:
             return
+        for board in list(self.boards):
+            if board.failed:
+                self.remove_board(board)
+
+        table = slots
+        if not isinstance(table, slottable.SlotTable):
+            table = self.slot_table
+            key = (tuple((id(s), id(s.pin)) for s in slots), tuple(id(b) for b in self.boards))
+            if table.stale(key):
+                table.compile(slots, self.boards, key)
+        if not len(table):
+            return
 
-        instr = []
-        for slot in slots:
-            if slot.state_idx is None:
-                instr.append([slot.pin.type_id, slot.pin.id, slot.state()])
-            else:
-                data = slot.state(slot.state_idx)
-                if slot.type == 'digital':
-                    if data:
-                        data = 100  # pin HIGH if data > 0
-                    else:
-                        data = 0
-                elif slot.type == 'dac':
-                    if data is None:
-                        data = 0
-                    else:
-                        data = self.scale_point(data)[slot.state_idx]
-                instr.append([slot.pin.type_id, slot.pin.id, data])
-
-        if not self.serial_device.send_instructions(instr):
-            self.close()
+        out = table.convert(table.gather(), self.scale_dac, self.max_dac)
+        if len(table.logged_digital):
+            self.digital_states.update(zip(table.digital_labels, out[table.logged_digital].tolist()))
+        for board, board_instr in table.instructions(out):
+            # a board may have gone since the table was compiled
+            if board in self.boards:
+                board.post(board_instr, table.positional.get(board))
+
+    def board_of(self, pin):
+        """ Board a pin belongs to, None if its board is gone. """
+        for b in self.boards:
+            if pin in b.device.pins[pin.type]:
+                return b
+        return None
+
+    def scheduler_stats(self):
+        """ Achieved rate and timing jitter of the fixed-rate output, worst board. """
+        return merge_stats([b.scheduler.stats.as_dict() for b in self.boards if b.scheduler])
+
+    def output_stats(self):
+        """ Counters of the output threads: sends, coalesced values, write latency. """
+        return merge_stats([b.output.stats.as_dict() for b in self.boards])
 
     def pins_for_slot(self, slot):
         return self.pins(slot.type)
 
-    def scale_point(self, point):
-        coord_max = max(self.range_xy)
+    def scale_dac(self, values, axes):
+        """ DAC values of arrays of position coordinates, axis 0 for x and
+        1 for y, not yet clipped to the DAC range.
+        """
+        return np.trunc(values * self.dac_gain[axes] + self.dac_offset[axes])
 
-        # center point coordinates into range
-        xc = point[0] + (coord_max - self.range_xy[0])/2.0
-        # Y coordinate has to be flipped, origin is _upper_ left corner
-        yc = (self.range_xy[1] - point[1]) + (coord_max - self.range_xy[1])/2.0
-        xc = int(xc * self.factor_dac + self.offset_dac)
-        yc = int(yc * self.factor_dac + self.offset_dac)
-        return xc, yc
+    def scale_point(self, point):
+        xc, yc = self.scale_dac(np.asarray(point[:2], float), np.arange(2))
+        return int(xc), int(yc)
 
     def read_all(self):
         if not self.serial_device:
@@ -179,20 +405,24 @@ class Chatter:
         return self.serial_device.read_line()
 
     def is_open(self):
-        return self.serial_device and self.serial_device.is_open()
+        return any(b.device.is_open() for b in self.boards)
 
     def is_connected(self):
         return self.connected  # self.is_open() and
 
+    def is_connecting(self):
+        """ True while ports are being probed in the background. """
+        return self.connecting
+
     def bytes_tx(self):
-        if self.serial_device:
-            return self.serial_device.bytes_sent
+        if self.boards:
+            return sum(b.device.bytes_sent for b in self.boards)
         else:
             return None
 
     def bytes_rx(self):
-        if self.serial_device:
-            return self.serial_device.bytes_received
+        if self.boards:
+            return sum(b.device.bytes_received for b in self.boards)
         else:
             return None
 
@@ -203,14 +433,14 @@ class Chatter:
             return None
 
     def pins(self, pin_type):
-        if self.serial_device:
+        """ Pins of a type of all boards. """
+        pins = []
+        for b in self.boards:
             try:
-                return self.serial_device.pins[pin_type]
+                pins.extend(b.device.pins[pin_type])
             except BaseException, error:
                 self.log.error(error)
-                return []
-        else:
-            return []
+        return pins
 
     def test_scan_frame(self, step_size=4):
         """Scan through all points in frame size and give their coordinates as analog
@@ -245,9 +475,17 @@ class Chatter:
         port remains open!
         """
         self.log.info('Closing chatter')
-        self.connected = False
-        if self.serial_device:
-            self.serial_device.close()
+        # probes of a running auto_connect may no longer take over
+        with self.lock:
+            self.probe_session += 1
+            self.connected = False
+        self.connecting = False
+        self.digital_states = {}
+        boards, self.boards = self.boards, []
+        self.next_pin_id = {}
+        for b in boards:
+            self.release_pins(b)
+            b.close()
 
 #############################################################
 if __name__ == '__main__':
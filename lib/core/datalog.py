@@ -2,50 +2,214 @@ import sys
 import time
 import datetime
 import os
+import json
+import zlib
+import gzip
+import Queue
 import logging
+import threading
 from lib import utilities as utils
+import binlog
+import eventlog
 from datetime import datetime
-import json
+
+FLUSH_INTERVAL = 1.0        # seconds between flush and fsync of the log file
+BATCH_SIZE = 512            # maximum number of records formatted and written at once
+BUFFER_SIZE = 1024 * 1024   # size of the file buffer in bytes
+COMPRESSION_LEVEL = binlog.COMPRESSION_LEVEL  # 0 disables compression, 1 (fast) - 9 (small)
+
+_STOP = None  # sentinel telling the writing thread to finish up
+
+
+class TextLog:
+    """
+    Original log format, one line of json with stringified values per sample.
+    """
+    extension = '.txt'
+
+    def __init__(self, destination, objects=None, leds=None, **info):
+        self.destination = destination
+        self.file = open(destination, 'wb', BUFFER_SIZE)
+        self.write("############### log started: "+ datetime.now().strftime("%H:%M:%S.%f")+'\r\n')
+        self.write("############### the log data is saved in json format. The data structure is the following:\r\n")
+        self.write("###############        time stamp,\r\n")
+        self.write("###############        object_0: label, X, Y, speed, direction, linked LEDs (to object_0): label, position \r\n")
+        self.write("###############        object_1: label, X, Y, speed, direction, linked LEDs (to object_0): label, position \r\n")
+
+    def write(self, text):
+        self.file.write(text)
+
+    @staticmethod
+    def snapshot(frame, objects):
+        """
+        Current state of all objects, as raw values. Cheap enough to be taken on
+        the tracking thread every frame, formatting happens in the logger thread.
+        """
+        return (frame.time_text,
+                [(o.label, o.getPositionX(), o.getPositionY(), o.getSpeed(), o.getOrientation(),
+                  [(l.label, l.position) for l in o.getLinkedLEDs()]) for o in objects])
+
+    def write_batch(self, batch):
+        lines = []
+        # same line layout as always, one sample wrapped in a list
+        for time_text, objects in batch:
+            lines.append(json.dumps([[time_text, [(str(label), str(x), str(y), str(speed), str(orientation),
+                                                   str(y), str(speed), str(orientation),
+                                                   [(str(l), str(p)) for l, p in leds])
+                                                  for label, x, y, speed, orientation, leds in objects]]]))
+        lines.append('')
+        self.write('\r\n'.join(lines))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    # helper code for reading back the log
+    @staticmethod
+    def read_log(path):
+        loglist = []
+        opener = gzip.open if path.lower().endswith('.gz') else open
+        f = opener(path, 'r')
+        try:
+            for line in f:
+                if not line.startswith('#'):
+                    loglist.append(json.loads(line.strip('\r\n')))
+        finally:
+            f.close()
+        return loglist
+
+
+class GzipTextLog(TextLog):
+    """
+    Text log, gzip compressed. Text is collected between flushes and each
+    flush writes it as a separate gzip member, so every block can be
+    decompressed on its own and a truncated file loses at most the last
+    block. Any gzip reader (gzip.open, zcat) reads the members in sequence.
+    """
+    extension = '.txt.gz'
+
+    def __init__(self, destination, objects=None, leds=None, compression=COMPRESSION_LEVEL, **info):
+        self.level = max(1, compression)
+        self.pending = []
+        TextLog.__init__(self, destination, objects, leds, **info)
+
+    def write(self, text):
+        self.pending.append(text)
+
+    def flush(self):
+        if self.pending:
+            # wbits offset by 16 makes zlib write gzip header and trailer
+            packer = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.file.write(packer.compress(''.join(self.pending)) + packer.flush())
+            self.pending = []
+        self.file.flush()
+
+
+# available log formats
+FORMATS = {'text': TextLog,
+           'text.gz': GzipTextLog,
+           'binary': binlog.ColumnarLogWriter,
+           'events': eventlog.EventLog}
 
 
 class DataLogger:
-    def __int__(self, defaultpath=None):
-        self.path=defaultpath
-    def start(self, path):
+    """
+    Writes object states to a log file, either text (one line of json per
+    sample, optionally gzipped) or the columnar binary format of binlog. The
+    file stays open while logging, samples are queued by update() and written
+    in batches by a background thread that flushes and fsyncs periodically.
+    Compression happens in that thread as well, block by block.
+    """
+
+    def __init__(self, defaultpath=None):
+        self.log = logging.getLogger(__name__)
+        self.path = defaultpath
+        self.destination = None
+        self.sink = None
+        self.queue = None
+        self.thread = None
+        self.n_records = 0
+
+    def start(self, path, fmt='text', objects=(), leds=(), compression=COMPRESSION_LEVEL):
+        """
+        Open a new log. The binary format fixes its columns to the given
+        objects and LEDs at this point. compression is the zlib level used
+        by the binary and gzipped text formats, 0 writes binary chunks raw.
+        """
+        self.stop()
         self.zerotime=time.time()
+        sink_class = FORMATS[fmt]
+        ext = sink_class.extension
         if path is None:
-            self.destination = 'recordings/log' + utils.time_string() +'.txt'
+            self.destination = 'recordings/log' + utils.time_string() + ext
         else:
-            if not path.lower().endswith('txt'):
-                self.destination=path+utils.time_string()+'.txt'
+            if not path.lower().endswith(ext):
+                self.destination=path+utils.time_string()+ext
             else:
                 self.destination=path
-        with open(self.destination, 'w') as text_file:
-            text_file.write("############### log started: "+ datetime.now().strftime("%H:%M:%S.%f")+'\r\n')
-            text_file.write("############### the log data is saved in json format. The data structure is the following:\r\n")
-            text_file.write("###############        time stamp,\r\n")
-            text_file.write("###############        object_0: label, X, Y, speed, direction, linked LEDs (to object_0): label, position \r\n")
-            text_file.write("###############        object_1: label, X, Y, speed, direction, linked LEDs (to object_0): label, position \r\n")
+        self.sink = sink_class(self.destination, objects=objects, leds=leds, compression=compression,
+                               started=utils.time_string())
 
+        self.n_records = 0
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='DataLogger')
+        self.thread.daemon = True
+        self.thread.start()
+        self.log.debug("Logging to %s", self.destination)
 
-    def update(self, slots, objects):
-        #print slots
-        txt=json.dumps(objects)
-        with open(self.destination, 'a') as text_file:
-            text_file.write(txt+'\r\n')
-           # text_file.write(','.join(objects))
+    def snapshot(self, frame, objects):
+        """ Sample of the current state in the format of the open log. """
+        return self.sink.snapshot(frame, objects)
 
-    # helper code for reading back the log
-    def read_log(path):
-        loglist = []
-        with open(path, 'r') as f:
-            for line in f:
-                if line.startswith('#'):
-                    pass
-                else:
-                    line.strip('\r\n')
-                    print line
-                    loglist.append(json.loads(line))
-        return loglist
+    def update(self, slots, record):
+        """ Queue a snapshot of the object states, never blocks. """
+        if self.queue is not None:
+            self.queue.put_nowait(record)
+
+    def stop(self):
+        """ Write out all queued records and close the file. """
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join()
+            self.log.debug("Closed log %s after %d records", self.destination, self.n_records)
+        self.thread = None
+        self.queue = None
+
+    def run(self):
+        """ Logger thread. Collects queued records into batches and writes them. """
+        last_sync = time.time()
+        running = True
+        while running:
+            try:
+                batch = [self.queue.get(timeout=FLUSH_INTERVAL)]
+            except Queue.Empty:
+                batch = []
+            while batch and len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            if _STOP in batch:
+                batch = batch[:batch.index(_STOP)]
+                running = False
 
+            if batch:
+                self.sink.write_batch(batch)
+                self.n_records += len(batch)
 
+            if not running or time.time() - last_sync >= FLUSH_INTERVAL:
+                self.sync()
+                last_sync = time.time()
+
+        self.sink.close()
+        self.sink = None
+
+    def sync(self):
+        self.sink.flush()
+        os.fsync(self.sink.file.fileno())
+
+    # helper code for reading back the log
+    read_log = staticmethod(TextLog.read_log)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Software stand-in for the Arduino Mega running Spotter_MCv2.0.ino.
+
+Opens a pseudo terminal and answers on its slave end like the firmware
+would: reports (echo, number of DACs, number of digital outputs, protocol
+version), DAC and digital instructions, in the legacy 4 byte form and as
+checksummed packets. Every decoded output is appended to a timeline with the
+time it arrived, so the host side can be exercised and benchmarked without
+hardware. The serial link speed is simulated, a pty by itself has none.
+
+Usage:
+    emulator.py [options]
+    emulator.py --extrapolation [options]
+    emulator.py -h | --help
+
+Options:
+    -h --help           Show this screen
+    -n --frames N       Number of frames to send [default: 1000]
+    -f --fps FPS        Frame rate of the updates [default: 190]
+    -b --baud BAUD      Simulated baud rate, 0 for unlimited [default: 115200]
+    -p --protocol P     Serial protocol, auto or legacy [default: auto]
+    -x --extrapolation  Check the output scheduler instead of benchmarking
+    -D --DEBUG          Verbose output
+
+Example:
+    emu = ArduinoEmulator().start()
+    chatter = Chatter(emu.port)
+    ...
+    emu.timeline  # [(time, 'dac', 0, 2048), ...]
+    emu.stop()
+"""
+
+import os
+import pty
+import sys
+import time
+import tty
+import select
+import logging
+import threading
+
+from lib.docopt import docopt
+
+SPI_N_DEVS = 4          # DACs of the MC v2.0 board
+DOUT_N = 4              # digital outputs
+DACMAX = 4095
+SCALE_FACTOR = 4096 / 640
+PROTOCOL_VERSION = 2    # 1 emulates firmware without packet support
+PACKET_SYNC = 0xA5
+PACKET_MAX_PINS = 16
+
+TYPE_UTILITY = 0
+TYPE_SPI_DAC = 1
+TYPE_DIGITAL = 2
+
+BITS_PER_BYTE = 10      # start, 8 data, stop bit
+
+
+class ArduinoEmulator:
+    """ Firmware emulator on a pty. Open port with any serial library. """
+
+    def __init__(self, n_dacs=SPI_N_DEVS, n_digital=DOUT_N, protocol_version=PROTOCOL_VERSION,
+                 baud_rate=115200):
+        self.log = logging.getLogger(__name__)
+        self.n_dacs = n_dacs
+        self.n_digital = n_digital
+        self.protocol_version = protocol_version
+        self.baud_rate = baud_rate
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.dacs = [0] * n_dacs
+        self.digital = [0] * n_digital
+        # (arrival time, 'dac' or 'digital', address, value as received)
+        self.timeline = []
+
+        self.n_bytes = 0
+        self.n_commands = 0
+        self.n_packets = 0
+        self.n_dropped = 0  # invalid commands and packets failing their checksum
+
+        self.buffer = bytearray()
+        self.line_free = 0.0
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name='ArduinoEmulator')
+        self.thread.daemon = True
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread.is_alive():
+            self.thread.join(1.0)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            self.arrive(len(data))
+            self.n_bytes += len(data)
+            self.buffer.extend(data)
+            self.parse()
+
+    def arrive(self, n_bytes):
+        """ Hold back until the bytes would have been transferred at the
+        simulated baud rate.
+        """
+        if not self.baud_rate:
+            return
+        now = time.time()
+        self.line_free = max(now, self.line_free) + n_bytes * BITS_PER_BYTE / float(self.baud_rate)
+        if self.line_free > now:
+            time.sleep(self.line_free - now)
+
+    def parse(self):
+        """ Consume all complete commands and packets from the buffer. """
+        buf = self.buffer
+        t = time.time()
+        pos = 0
+        while pos < len(buf):
+            if buf[pos] == PACKET_SYNC and self.protocol_version >= 2:
+                if pos + 2 > len(buf):
+                    break
+                n = buf[pos + 1]
+                end = pos + 2 + 3 * n + 1
+                if end > len(buf):
+                    break
+                if n > PACKET_MAX_PINS:
+                    # read to its end and dropped, like the firmware does
+                    self.n_dropped += 1
+                elif sum(buf[pos + 1:end - 1]) & 0xFF == buf[end - 1]:
+                    self.n_packets += 1
+                    for i in xrange(pos + 2, end - 1, 3):
+                        self.execute(buf[i], buf[i + 1] | buf[i + 2] << 8, t)
+                else:
+                    self.n_dropped += 1
+                pos = end
+            else:
+                if pos + 4 > len(buf):
+                    break
+                if buf[pos + 3] == ord('\n'):
+                    self.execute(buf[pos], buf[pos + 1] | buf[pos + 2] << 8, t)
+                else:
+                    self.n_dropped += 1
+                pos += 4
+        del buf[:pos]
+
+    def execute(self, cmd, value, t):
+        """ interpretCommand of the firmware. """
+        self.n_commands += 1
+        value = min(value, DACMAX)
+        addr = cmd & 0x07
+        cmd_type = (cmd & 0x38) >> 3
+        if cmd_type == TYPE_UTILITY:
+            self.report(addr, value)
+        elif cmd_type == TYPE_SPI_DAC:
+            if addr < self.n_dacs:
+                self.dacs[addr] = value * SCALE_FACTOR
+                self.timeline.append((t, 'dac', addr, value))
+        elif cmd_type == TYPE_DIGITAL:
+            if addr < self.n_digital:
+                self.digital[addr] = 1 if value > 0 else 0
+                self.timeline.append((t, 'digital', addr, value))
+
+    def report(self, request, value):
+        if request == 0:
+            answer = value
+        elif request == 1:
+            answer = self.n_dacs
+        elif request == 2:
+            answer = self.n_digital
+        elif request == 3 and self.protocol_version >= 2:
+            answer = self.protocol_version
+        else:
+            return
+        os.write(self.master, '%d\r\n' % answer)
+
+    def outputs(self, kind, addr):
+        """ Timeline of one output as lists of arrival times and values. """
+        entries = [(t, v) for t, k, a, v in self.timeline if k == kind and a == addr]
+        return [e[0] for e in entries], [e[1] for e in entries]
+
+
+def benchmark(n_frames=1000, fps=190.0, baud_rate=115200, protocol='auto'):
+    """
+    Drive a Chatter connected to an emulator with per-frame updates of two
+    DACs and one digital pin, like a tracked object with one region. The
+    value on DAC 0 identifies the frame, which gives the latency from
+    posting to arrival at the board.
+    """
+    from lib.core import chatter
+
+    emu = ArduinoEmulator(baud_rate=baud_rate).start()
+    ch = chatter.Chatter(emu.port)
+    if not ch.is_connected():
+        emu.stop()
+        raise IOError("Handshake with emulator failed")
+    ch.serial_device.detect_protocol(protocol)
+    emu.timeline = []
+    tx_start = ch.bytes_tx()
+
+    posted = {}
+    t_start = time.time()
+    for i in xrange(n_frames):
+        t_frame = t_start + i / fps
+        delay = t_frame - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        value = i % (DACMAX + 1)
+        posted[value] = time.time()
+        ch.boards[0].output.post([[1, 0, value], [1, 1, DACMAX - value], [2, 0, 100 if (i // 50) % 2 else 0]])
+    time.sleep(0.2)
+    duration = time.time() - t_start
+
+    times, values = emu.outputs('dac', 0)
+    latencies = sorted(t - posted[v] for t, v in zip(times, values) if v in posted)
+    stats = ch.output_stats()
+    result = {'protocol': ch.serial_device.protocol,
+              'frames': n_frames,
+              'bytes': ch.bytes_tx() - tx_start,
+              'bytes_per_frame': (ch.bytes_tx() - tx_start) / float(n_frames),
+              'received': len(values),
+              'coalesced': stats['n_coalesced'],
+              'throughput': len(emu.timeline) / duration,
+              'latency_median': latencies[len(latencies) // 2] if latencies else None,
+              'latency_max': latencies[-1] if latencies else None}
+    ch.close()
+    emu.stop()
+    return result
+
+
+def extrapolation_check(n_frames=30, fps=30.0, rate=500.0, step=10):
+    """
+    Move an object by step pixels per frame with its x position and its
+    orientation on DACs behind an output scheduler. Counts the distinct
+    values each DAC received and those between frame values: the position
+    should be extrapolated between frames, the orientation held.
+    """
+    from lib.core import chatter
+    from lib.core.trackables import Slot
+
+    emu = ArduinoEmulator(baud_rate=0).start()
+    ch = chatter.Chatter(emu.port, output_rate=rate)
+    if not ch.is_connected():
+        emu.stop()
+        raise IOError("Handshake with emulator failed")
+    frame = [0]
+    x = Slot('x position', 'dac', lambda: 100 + step * frame[0], positional=True)
+    orientation = Slot('head orientation', 'dac', lambda: 100 + step * frame[0])
+    x.attach_pin(ch.pins('dac')[0])
+    orientation.attach_pin(ch.pins('dac')[1])
+    emu.timeline = []
+
+    t_start = time.time()
+    for frame[0] in xrange(n_frames):
+        delay = t_start + frame[0] / fps - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        ch.update_pins([x, orientation])
+    time.sleep(0.1)
+
+    result = {}
+    for label, pin in (('position', 0), ('orientation', 1)):
+        values = set(emu.outputs('dac', pin)[1])
+        result[label + '_values'] = len(values)
+        result[label + '_between'] = len([v for v in values if (v - 100) % step])
+    ch.close()
+    emu.stop()
+    return result
+
+
+#############################################################
+if __name__ == '__main__':
+#############################################################
+    arguments = docopt.docopt(__doc__, version='emulator 0.1')
+    logging.basicConfig(level=logging.DEBUG if arguments['--DEBUG'] else logging.INFO)
+    if arguments['--extrapolation']:
+        result = extrapolation_check()
+    else:
+        result = benchmark(int(arguments['--frames']), float(arguments['--fps']),
+                           int(arguments['--baud']), arguments['--protocol'])
+    for key in sorted(result):
+        print '%-16s %s' % (key, result[key])
+    sys.exit(0)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Event stream of region transitions and digital output changes.
+
+Instead of dumping the state of all objects every frame, only changes are
+logged, each stamped with the tickstamp and index of the frame it happened
+in: an object entering or leaving a region, an object crossing a line of a
+region, and a digital output pin switching. Line crossings are found between
+consecutive positions and stamped with the time interpolated along the
+movement, which stays accurate when tracking at a reduced frame rate.
+
+The EventDetector runs on the tracking thread and compares the collision
+results of the current frame (RegionOfInterest.update_collisions) and the
+digital pin values last sent by the Chatter with the previous frame. The
+resulting events are written by a DataLogger with the EventLog sink.
+
+Log format, one tab separated line per event:
+    tickstamp, frame index, kind, source, subject, value
+
+    kind    source          subject         value
+    enter   region label    object label    shape label
+    exit    region label    object label    shape label of the entry
+    cross   region label    object label    line shape label
+    pin     pin label       -               new pin value
+"""
+
+import logging
+
+ENTER = 'enter'
+EXIT = 'exit'
+CROSS = 'cross'
+PIN = 'pin'
+
+COLUMNS = ('tickstamp', 'index', 'kind', 'source', 'subject', 'value')
+
+
+class EventDetector:
+    """ Turns per-frame states into transition events. Objects whose
+    position is unknown keep their last region state, so tracking dropouts
+    do not show up as exits and entries.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+        # (region, object) -> shape the object is in, or None
+        self.inside = {}
+        # pin label -> last value
+        self.pins = {}
+        self.n_events = 0
+
+    def update(self, frame, rois, digital_states=None):
+        """ List of events of this frame, as tuples in COLUMNS order. """
+        events = []
+        stamp = (frame.tickstamp, frame.index)
+        for r in rois:
+            for o, collision in r.collisions.iteritems():
+                if collision is None:
+                    continue
+                hit = r.hits.get(o)
+                key = (r, o)
+                if hit is not None and hit.shape == 'line':
+                    # crossing a line leaves the region state as it is
+                    events.append((self.crossing_time(frame, r.crossings.get(o)), frame.index,
+                                   CROSS, r.label, o.label, hit.label))
+                    continue
+                previous = self.inside.get(key)
+                if (hit is None) != (previous is None):
+                    if hit is None:
+                        events.append(stamp + (EXIT, r.label, o.label, previous.label))
+                    else:
+                        events.append(stamp + (ENTER, r.label, o.label, hit.label))
+                self.inside[key] = hit
+
+        if digital_states:
+            for label, value in digital_states.iteritems():
+                if self.pins.get(label) != value:
+                    events.append(stamp + (PIN, label, None, value))
+                    self.pins[label] = value
+
+        self.n_events += len(events)
+        return events
+
+    @staticmethod
+    def crossing_time(frame, crossing):
+        """ Tickstamp at which the object crossed, interpolated along the
+        movement from its previous position.
+        """
+        if crossing is None or crossing[0] is None or not crossing[1]:
+            return frame.tickstamp
+        fraction, dt = crossing
+        return frame.tickstamp - int(round((1 - fraction) * dt))
+
+    def reset(self):
+        self.inside = {}
+        self.pins = {}
+
+
+class EventLog:
+    """ DataLogger sink writing events as tab separated text. Records are
+    the event lists of single frames.
+    """
+    extension = '.events.tsv'
+
+    def __init__(self, destination, objects=None, leds=None, **info):
+        self.destination = destination
+        self.file = open(destination, 'wb')
+        self.file.write('#' + '\t'.join(COLUMNS) + '\n')
+
+    def write_batch(self, batch):
+        lines = []
+        for events in batch:
+            for e in events:
+                lines.append('\t'.join('-' if v is None else str(v) for v in e))
+        lines.append('')
+        self.file.write('\n'.join(lines))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def read_log(path):
+        """ List of event tuples, with tickstamp and frame index as ints. """
+        events = []
+        with open(path, 'r') as f:
+            for line in f:
+                if line.startswith('#') or not line.strip():
+                    continue
+                fields = line.rstrip('\n').split('\t')
+                events.append(tuple([int(fields[0]), int(fields[1])] + fields[2:]))
+        return events
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Uniform grid index over the shapes of all regions.
+
+The frame is divided into square cells, every shape is registered in the
+cells its bounding box overlaps. Each frame an object only needs to be
+tested against the shapes in the cells it occupies, or for line crossings
+the cells around its movement since the previous position, instead of
+against every shape of every region. Regions without shapes near an object
+are skipped altogether.
+
+The index is kept up to date incrementally: regions register shapes when
+they are added or removed, and shapes re-register themselves when moved
+(Shape.move, Shape.move_to).
+"""
+
+import math
+import logging
+import itertools
+
+CELL_SIZE = 32  # pixels
+
+
+class GridIndex:
+    """ Maps grid cells to the shapes overlapping them. """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.log = logging.getLogger(__name__)
+        self.cell_size = float(cell_size)
+        self.cells = {}         # (column, row) -> set of shapes
+        self.shape_cells = {}   # shape -> list of its cells
+        self.owner = {}         # shape -> region
+        # shapes are tested in the order they were added to their region
+        self.order = {}
+        self.counter = itertools.count()
+        # result of locate: object -> {region: [shapes]}
+        self.near_shapes = {}
+
+    def __len__(self):
+        return len(self.shape_cells)
+
+    @staticmethod
+    def bounds(shape):
+        """ Bounding box (x0, y0, x1, y1) of a shape. """
+        if shape.shape == 'circle':
+            (cx, cy), r = shape.points[0], shape.radius
+            return cx - r, cy - r, cx + r, cy + r
+        xs = [p[0] for p in shape.points]
+        ys = [p[1] for p in shape.points]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def cell_range(self, x0, y0, x1, y1):
+        c = self.cell_size
+        return [(i, j) for i in xrange(int(math.floor(x0 / c)), int(math.floor(x1 / c)) + 1)
+                for j in xrange(int(math.floor(y0 / c)), int(math.floor(y1 / c)) + 1)]
+
+    def insert(self, shape, region):
+        if shape in self.shape_cells:
+            self.remove(shape)
+        cells = self.cell_range(*self.bounds(shape))
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(shape)
+        self.shape_cells[shape] = cells
+        self.owner[shape] = region
+        if shape not in self.order:
+            self.order[shape] = next(self.counter)
+        shape.index = self
+
+    def remove(self, shape):
+        for cell in self.shape_cells.pop(shape, []):
+            members = self.cells[cell]
+            members.discard(shape)
+            if not members:
+                del self.cells[cell]
+        self.owner.pop(shape, None)
+        self.order.pop(shape, None)
+        shape.index = None
+
+    def update(self, shape):
+        """ Re-register a moved shape. """
+        if shape not in self.shape_cells:
+            return
+        cells = self.cell_range(*self.bounds(shape))
+        if cells == self.shape_cells[shape]:
+            return
+        region = self.owner[shape]
+        order = self.order[shape]
+        self.remove(shape)
+        self.insert(shape, region)
+        self.order[shape] = order
+
+    def query(self, x0, y0, x1, y1):
+        """ Set of shapes whose cells overlap the box. """
+        found = set()
+        for cell in self.cell_range(x0, y0, x1, y1):
+            members = self.cells.get(cell)
+            if members:
+                found.update(members)
+        return found
+
+    def locate(self, objects):
+        """ Collect the shapes near every object, by region. """
+        self.near_shapes = {}
+        for o in objects:
+            p = o.position
+            if p is None:
+                continue
+            previous = o.last_step()[0]
+            if previous is None:
+                found = self.query(p[0], p[1], p[0], p[1])
+            else:
+                found = self.query(min(p[0], previous[0]), min(p[1], previous[1]),
+                                   max(p[0], previous[0]), max(p[1], previous[1]))
+            near = {}
+            for s in sorted(found, key=self.order.get):
+                near.setdefault(self.owner[s], []).append(s)
+            self.near_shapes[o] = near
+
+    def near(self, obj, region):
+        """ Shapes of region near obj at the last locate, in region order. """
+        return self.near_shapes.get(obj, {}).get(region, [])
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Live occupancy maps.
+
+Every tracked object accumulates the time it spends in each bin of a grid
+laid over the frame, and optionally the speed it had there, one addition per
+frame. The maps cover the whole session without keeping the position
+history, and can be shown over the video or exported at any time.
+
+Exported .npz files hold:
+    time        (rows, columns) ms spent in each bin
+    speed       (rows, columns) speed times ms in each bin, if speed weighted
+    bin_size    bin edge length in pixels
+    frame_size  (width, height) of the frame the grid covers
+"""
+
+import time
+import logging
+
+import cv2
+import numpy as np
+
+BIN_SIZE = 8           # pixels per bin edge
+OVERLAY_ALPHA = 0.5    # opacity of the occupied bins over the video
+
+
+class OccupancyMap:
+    """ Time per bin of one object. speed_weighted also sums speed * time,
+    which divided by time is the mean speed in each bin.
+    """
+
+    def __init__(self, frame_size, bin_size=BIN_SIZE, speed_weighted=False):
+        self.log = logging.getLogger(__name__)
+        self.frame_size = (int(frame_size[0]), int(frame_size[1]))
+        self.bin_size = bin_size
+        self.speed_weighted = speed_weighted
+        self.shape = (-(-self.frame_size[1] // bin_size), -(-self.frame_size[0] // bin_size))
+        self.reset()
+
+    def reset(self):
+        self.time = np.zeros(self.shape)
+        self.speed = np.zeros(self.shape) if self.speed_weighted else None
+        self.total = 0.0       # ms with a position inside the frame
+        self.n_updates = 0
+        self.t_start = time.time()
+        # colorized overlay, rebuilt when stale
+        self._overlay = None
+        self._overlay_key = None
+        self._overlay_time = 0
+
+    def update(self, position, dt, speed=None):
+        """ Add dt ms at position (x, y) to its bin. """
+        if position is None or not dt:
+            return
+        row = int(position[1]) // self.bin_size
+        col = int(position[0]) // self.bin_size
+        if not (0 <= row < self.shape[0] and 0 <= col < self.shape[1]):
+            return
+        self.time[row, col] += dt
+        if self.speed is not None and speed is not None:
+            self.speed[row, col] += speed * dt
+        self.total += dt
+        self.n_updates += 1
+
+    def fraction(self):
+        """ Fraction of the tracked time spent in each bin. """
+        return self.time / self.total if self.total else np.zeros(self.shape)
+
+    def mean_speed(self):
+        """ Mean speed in each bin, NaN where the object never was. """
+        if self.speed is None:
+            return None
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.time > 0, self.speed / self.time, np.nan)
+
+    def overlay(self, frame_shape, min_interval=0.5):
+        """
+        Colorized map scaled to frame_shape (height, width), BGR uint8, and
+        the mask of visited pixels. Recomputed at most every min_interval
+        seconds.
+        """
+        key = (tuple(frame_shape[:2]), self.n_updates)
+        if self._overlay is not None and key[0] == self._overlay_key[0] and \
+                (key[1] == self._overlay_key[1] or time.time() - self._overlay_time < min_interval):
+            return self._overlay
+        level = np.zeros(self.shape, np.uint8)
+        visited = self.time > 0
+        if visited.any():
+            # log scale, short visits stay visible next to the favourite corner
+            t = np.log1p(self.time)
+            level[visited] = (64 + 191 * t[visited] / t.max()).astype(np.uint8)
+        size = (frame_shape[1], frame_shape[0])
+        heat = cv2.applyColorMap(cv2.resize(level, size, interpolation=cv2.INTER_NEAREST), cv2.COLORMAP_JET)
+        mask = cv2.resize(visited.astype(np.uint8), size, interpolation=cv2.INTER_NEAREST) > 0
+        self._overlay = (heat, mask)
+        self._overlay_key = key
+        self._overlay_time = time.time()
+        return self._overlay
+
+    def draw(self, img, alpha=OVERLAY_ALPHA):
+        """ Blend the map into a BGR frame in place, visited bins only. """
+        heat, mask = self.overlay(img.shape)
+        if mask.any():
+            img[mask] = (img[mask] * (1 - alpha) + heat[mask] * alpha).astype(np.uint8)
+
+    def save(self, path):
+        """ Export as .npz (see module doc), or as image for .png/.jpg/.tif. """
+        if path.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff')):
+            heat, mask = self.overlay((self.shape[0] * self.bin_size, self.shape[1] * self.bin_size), 0)
+            heat = np.where(mask[..., None], heat, 0).astype(np.uint8)
+            cv2.imwrite(path, heat)
+        else:
+            arrays = {'time': self.time, 'bin_size': self.bin_size,
+                      'frame_size': np.array(self.frame_size)}
+            if self.speed is not None:
+                arrays['speed'] = self.speed
+            np.savez_compressed(path, **arrays)
+        self.log.info("Saved occupancy map to %s", path)
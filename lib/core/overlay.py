@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Cheap frame stamps burnt into video frames.
+
+TimestampOverlay renders each glyph once with cv2.putText and keeps the
+rendered text as a small strip. Per frame only characters that changed are
+blitted into the strip, and the strip is copied into the frame with a single
+slice assignment.
+
+FrameCode writes the frame index as a row of black and white cells into a
+corner of the frame, which can be decoded exactly during analysis.
+"""
+
+import cv2
+import numpy as np
+
+# glyphs rendered up front, all others are rendered on first use
+PRERENDERED = '0123456789-:. '
+# all glyphs share the cell width of the widest printable character
+PRINTABLE = ''.join(chr(c) for c in xrange(32, 127))
+
+
+class TimestampOverlay:
+    """ Draw text onto frames from a cache of pre-rendered glyphs. The text
+    is drawn on an opaque background box, monospaced.
+    """
+
+    def __init__(self, org=(15, 20), font_face=cv2.FONT_HERSHEY_PLAIN, font_scale=1.6,
+                 color=(250, 250, 50), thickness=1, line_type=None, background=(0, 0, 0)):
+        if line_type is None:
+            # antialiased lines, CV_AA was renamed to LINE_AA in OpenCV 3
+            line_type = getattr(cv2, 'CV_AA', getattr(cv2, 'LINE_AA', 16))
+        self.font_face = font_face
+        self.font_scale = font_scale
+        self.color = color
+        self.thickness = thickness
+        self.line_type = line_type
+        self.background = background
+
+        # cell size from the largest glyph
+        sizes = [cv2.getTextSize(c, font_face, font_scale, thickness) for c in PRINTABLE]
+        self.cell_w = max(s[0][0] for s in sizes) + 1
+        self.ascent = max(s[0][1] for s in sizes) + 1
+        self.cell_h = self.ascent + max(s[1] for s in sizes) + 1
+
+        # org is the baseline origin, like in cv2.putText
+        self.x = org[0]
+        self.y = max(0, org[1] - self.ascent)
+
+        self.glyphs = {}
+        for c in PRERENDERED:
+            self.glyph(c)
+
+        self.text = ''
+        self.strip = None
+
+    def glyph(self, char):
+        """ Rendered glyph of a character, renders into the cache if missing. """
+        try:
+            return self.glyphs[char]
+        except KeyError:
+            cell = np.empty((self.cell_h, self.cell_w, 3), np.uint8)
+            cell[:] = self.background
+            cv2.putText(img=cell, text=char, org=(0, self.ascent), fontFace=self.font_face,
+                        fontScale=self.font_scale, color=self.color, thickness=self.thickness,
+                        lineType=self.line_type)
+            self.glyphs[char] = cell
+            return cell
+
+    def update(self, text):
+        """ Update the strip with all characters differing from the last text. """
+        if self.strip is None or len(text) != len(self.text):
+            self.strip = np.empty((self.cell_h, self.cell_w * len(text), 3), np.uint8)
+            self.text = ''
+        w = self.cell_w
+        if self.text:
+            for i, c in enumerate(text):
+                if c != self.text[i]:
+                    self.strip[:, i*w:(i+1)*w] = self.glyph(c)
+        else:
+            for i, c in enumerate(text):
+                self.strip[:, i*w:(i+1)*w] = self.glyph(c)
+        self.text = text
+
+    def draw(self, img, text):
+        """ Stamp text into image in place, clipped to the image borders. """
+        self.update(text)
+        h = min(self.cell_h, img.shape[0] - self.y)
+        w = min(self.strip.shape[1], img.shape[1] - self.x)
+        if h > 0 and w > 0:
+            img[self.y:self.y+h, self.x:self.x+w] = self.strip[:h, :w]
+        return img
+
+
+class FrameCode:
+    """ Binary pixel barcode of the frame index. A start pattern of two cells
+    (white, black) is followed by n_bits data cells, LSB first. Each cell is
+    a square of cell x cell pixels, large enough to survive lossy codecs.
+    """
+    START = (1, 0)
+
+    def __init__(self, n_bits=32, cell=4, org=(0, 0)):
+        self.n_bits = n_bits
+        self.cell = cell
+        self.x, self.y = org
+        self.n_cells = len(self.START) + n_bits
+        self.shifts = np.arange(n_bits, dtype=np.uint64)
+
+    def cells(self, value):
+        """ Cell values (0/1) for value, including start pattern. """
+        bits = (np.uint64(value) >> self.shifts) & np.uint64(1)
+        return np.concatenate((np.array(self.START, np.uint8), bits.astype(np.uint8)))
+
+    def draw(self, img, value):
+        """ Write value into the image in place. """
+        row = np.repeat(self.cells(value) * 255, self.cell)
+        block = img[self.y:self.y+self.cell, self.x:self.x+self.n_cells*self.cell]
+        if img.ndim == 3:
+            block[:] = row[np.newaxis, :, np.newaxis]
+        else:
+            block[:] = row[np.newaxis, :]
+        return img
+
+    def decode(self, img):
+        """ Read value back from an image. Returns None if no start pattern found. """
+        c = self.cell
+        centers_x = self.x + np.arange(self.n_cells) * c + c // 2
+        samples = img[self.y + c // 2, centers_x]
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        bits = samples > 127
+        if tuple(bits[:len(self.START)]) != tuple(bool(b) for b in self.START):
+            return None
+        value = 0
+        for i, b in enumerate(bits[len(self.START):]):
+            if b:
+                value |= 1 << i
+        return value
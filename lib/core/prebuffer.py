@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-trigger ring buffer for event-triggered recording.
+
+Instead of writing every frame to disk, the most recent frames are kept in a
+bounded ring in memory (optionally JPEG compressed). Once a trigger fires, e.g.
+an object entering a region, the ring is handed to the writer followed by
+a fixed stretch of post-trigger footage.
+"""
+
+import logging
+import Queue
+from collections import deque
+
+import cv2
+import numpy as np
+
+PRE_TRIGGER_SECONDS = 2.0   # footage kept in memory before a trigger fires
+POST_TRIGGER_SECONDS = 5.0  # footage written after the last trigger
+JPEG_QUALITY = 90           # only used if the ring buffer is compressed
+
+
+class RegionTrigger:
+    """ Fires while an object is colliding with a region. Reads the collision
+    result the region already computed for the current frame (see
+    RegionOfInterest.update_collisions), so line crossings are not consumed
+    twice. If no object given, any object of the region will do.
+    """
+
+    def __init__(self, roi, obj=None):
+        self.roi = roi
+        self.obj = obj
+
+    def __call__(self):
+        objects = [self.obj] if self.obj is not None else self.roi.oois
+        if not objects:
+            return False
+        for o in objects:
+            if self.roi.test_collision(o):
+                return True
+        return False
+
+
+class AnyRegionTrigger:
+    """ Fires while any object is colliding with any region of a list. The
+    list is read on every call, so regions added or removed while recording
+    are followed.
+    """
+
+    def __init__(self, rois):
+        self.rois = rois
+
+    def __call__(self):
+        for roi in self.rois:
+            for o in roi.oois:
+                if roi.test_collision(o):
+                    return True
+        return False
+
+
+class FrameRing:
+    """ Bounded FIFO of (frame, record) items. Oldest items are dropped
+    when full. With compression, frame images are stored JPEG encoded and
+    decoded again when the ring is drained.
+    """
+
+    def __init__(self, max_items, compress=False, quality=JPEG_QUALITY):
+        self.items = deque(maxlen=max(1, int(max_items)))
+        self.compress = compress
+        self.quality = quality
+
+    def __len__(self):
+        return len(self.items)
+
+    def append(self, item):
+        if self.compress:
+            frame = item[0]
+            rv, buf = cv2.imencode('.jpg', frame.img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if rv:
+                frame.img = buf
+                item = (frame, item[1], True)
+        self.items.append(item)
+
+    def drain(self):
+        """ Return all items oldest first, with images decoded, and empty the ring. """
+        drained = []
+        while self.items:
+            item = self.items.popleft()
+            if len(item) > 2:
+                frame = item[0]
+                frame.img = cv2.imdecode(np.asarray(frame.img), 1)
+                item = (frame, item[1])
+            drained.append(item)
+        return drained
+
+    def clear(self):
+        self.items.clear()
+
+
+class TriggeredCapture:
+    """ Decides which frames make it to the writer. Frames are held back in
+    the ring buffer until any trigger fires. The ring is then flushed and
+    frames pass straight through until post_seconds after the last trigger.
+    """
+
+    def __init__(self, fps, pre_seconds=PRE_TRIGGER_SECONDS, post_seconds=POST_TRIGGER_SECONDS,
+                 compress=False, quality=JPEG_QUALITY):
+        self.log = logging.getLogger(__name__)
+        self.triggers = []
+
+        self.ring = FrameRing(pre_seconds * fps, compress, quality)
+        self.post_frames = int(post_seconds * fps)
+        self.frames_left = 0
+
+        # items waiting to be handed to the writer queue, at most one event
+        # worth; if the writer falls further behind the oldest are dropped
+        self.pending = deque(maxlen=self.ring.items.maxlen + max(1, self.post_frames))
+        self.n_events = 0
+        self.n_dropped = 0
+        self.dropping = False
+
+    def add_trigger(self, trigger):
+        """ Trigger is any callable returning True while it is firing. """
+        self.triggers.append(trigger)
+        return trigger
+
+    def remove_trigger(self, trigger):
+        try:
+            self.triggers.remove(trigger)
+        except ValueError:
+            self.log.error("Trigger to be removed not found")
+
+    @property
+    def active(self):
+        """ True while footage is passed on to the writer. """
+        return self.frames_left > 0
+
+    def triggered(self):
+        for t in self.triggers:
+            if t():
+                return True
+        return False
+
+    def update(self, item):
+        """ Feed one (frame, record) item, evaluated against all triggers. """
+        if self.triggered():
+            if not self.active:
+                self.n_events += 1
+                self.log.debug("Recording triggered, flushing %d buffered frames", len(self.ring))
+                for queued in self.ring.drain():
+                    self.hold(queued)
+            self.frames_left = self.post_frames
+
+        if self.active:
+            self.hold(item)
+            self.frames_left -= 1
+        else:
+            self.ring.append(item)
+
+    def hold(self, item):
+        """ Keep item pending, dropping the oldest if the writer is too far behind. """
+        if len(self.pending) == self.pending.maxlen:
+            self.n_dropped += 1
+            if not self.dropping:
+                self.log.warning("Writer falling behind, dropping triggered frames")
+                self.dropping = True
+        self.pending.append(item)
+
+    def flush_to(self, queue, block=False):
+        """ Hand pending items to the writer queue. Non-blocking by default,
+        whatever does not fit stays pending for the next frame.
+        """
+        while self.pending:
+            try:
+                queue.put(self.pending[0], block)
+            except Queue.Full:
+                break
+            self.pending.popleft()
+        if not self.pending and self.dropping:
+            self.log.warning("Writer caught up, %d triggered frames dropped so far", self.n_dropped)
+            self.dropping = False
+
+    def reset(self):
+        self.ring.clear()
+        self.pending.clear()
+        self.frames_left = 0
+        self.dropping = False
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Publishes the tracked state of every frame on the local network or host.
+
+Each frame goes out as one datagram: the sidecar record (frame index,
+tickstamp, x, y, orientation and speed per object, x and y per LED, see
+sidecar.RecordPacker) behind a short header. Labels are not repeated per
+frame but sent in a layout message whenever objects or LEDs change, and once
+every LAYOUT_INTERVAL seconds for subscribers joining late.
+
+Sending never blocks: the socket is non-blocking and a datagram that can not
+be sent right away (no subscriber, full buffer) is dropped and counted.
+
+Addresses:
+    udp://239.255.42.99:5555    UDP multicast group (or any host) and port
+    unix:///tmp/spotter.sock    Unix datagram socket of a single subscriber
+
+Subscribing:
+    sub = Subscriber('udp://239.255.42.99:5555')
+    state = sub.receive(timeout=1.0)
+    state['objects']['mouse']  # (x, y, orientation, speed)
+"""
+
+import os
+import json
+import time
+import errno
+import socket
+import struct
+import logging
+
+import sidecar
+
+ADDRESS = 'udp://239.255.42.99:5555'
+LAYOUT_INTERVAL = 1.0   # seconds between repeated layout messages
+MULTICAST_TTL = 1       # keep multicast on the local network
+
+STATE_MAGIC = 'SPST'
+LAYOUT_MAGIC = 'SPLY'
+# magic, layout id, sequence number
+HEADER = struct.Struct('<4sII')
+
+
+def parse_address(address):
+    """ ('udp', (host, port)) or ('unix', path) """
+    if address.startswith('unix://'):
+        return 'unix', address[len('unix://'):]
+    if address.startswith('udp://'):
+        host, port = address[len('udp://'):].rsplit(':', 1)
+        return 'udp', (host, int(port))
+    raise ValueError("Unknown address %s" % address)
+
+
+def is_multicast(host):
+    try:
+        return 224 <= int(host.split('.')[0]) <= 239
+    except ValueError:
+        return False
+
+
+class Publisher:
+    """ Sends the state of every frame as one datagram. """
+
+    def __init__(self, address=ADDRESS, ttl=MULTICAST_TTL):
+        self.log = logging.getLogger(__name__)
+        self.address = address
+        self.kind, self.destination = parse_address(address)
+        if self.kind == 'unix':
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if is_multicast(self.destination[0]):
+                self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.socket.setblocking(False)
+
+        self.packer = None
+        self.layout = None
+        self.layout_id = 0
+        self.last_layout = 0
+
+        self.n_sent = 0
+        self.n_dropped = 0
+
+    def send(self, data):
+        try:
+            self.socket.sendto(data, self.destination)
+            self.n_sent += 1
+        except socket.error, e:
+            # nobody listening, or the buffer is full: drop
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOENT, errno.ECONNREFUSED,
+                               errno.ENOBUFS):
+                self.log.debug("Publishing failed: %s", e)
+            self.n_dropped += 1
+
+    def publish(self, frame, objects, leds):
+        """ Send the state of frame. Repacks the layout if objects or LEDs
+        were added or removed.
+        """
+        key = (tuple(id(o) for o in objects), tuple(id(l) for l in leds))
+        if key != self.layout:
+            self.layout = key
+            self.layout_id += 1
+            self.packer = sidecar.RecordPacker(objects, leds)
+            self.last_layout = 0
+
+        now = time.time()
+        if now - self.last_layout >= LAYOUT_INTERVAL:
+            self.last_layout = now
+            object_labels, led_labels = self.packer.labels
+            self.send(HEADER.pack(LAYOUT_MAGIC, self.layout_id, 0) +
+                      json.dumps({'objects': object_labels, 'object_fields': sidecar.OBJECT_FIELDS,
+                                  'leds': led_labels, 'led_fields': sidecar.LED_FIELDS}))
+
+        self.send(HEADER.pack(STATE_MAGIC, self.layout_id, frame.index & 0xFFFFFFFF) +
+                  self.packer.pack(frame))
+
+    def close(self):
+        self.socket.close()
+
+
+class Subscriber:
+    """ Receives published states. States arriving before the first
+    layout message can not be decoded and are skipped.
+    """
+
+    def __init__(self, address=ADDRESS):
+        self.kind, self.source = parse_address(address)
+        if self.kind == 'unix':
+            if os.path.exists(self.source):
+                os.unlink(self.source)
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.socket.bind(self.source)
+        else:
+            host, port = self.source
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if is_multicast(host):
+                self.socket.bind(('', port))
+                membership = struct.pack('4sl', socket.inet_aton(host), socket.INADDR_ANY)
+                self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            else:
+                self.socket.bind((host, port))
+
+        self.layout = None
+        self.layout_id = None
+        self.struct = None
+        self.n_skipped = 0
+
+    def set_layout(self, layout_id, layout):
+        self.layout = layout
+        self.layout_id = layout_id
+        n_values = len(layout['objects']) * len(layout['object_fields']) + \
+            len(layout['leds']) * len(layout['led_fields'])
+        self.struct = struct.Struct('<Iq' + 'f' * n_values)
+
+    def decode(self, data):
+        """ State dict of a datagram, None for layout messages. """
+        magic, layout_id, sequence = HEADER.unpack_from(data)
+        payload = data[HEADER.size:]
+        if magic == LAYOUT_MAGIC:
+            if layout_id != self.layout_id:
+                self.set_layout(layout_id, json.loads(payload))
+            return None
+        if magic != STATE_MAGIC or layout_id != self.layout_id:
+            self.n_skipped += 1
+            return None
+
+        values = self.struct.unpack(payload)
+        n_o, n_l = len(self.layout['object_fields']), len(self.layout['led_fields'])
+        state = {'index': values[0], 'tickstamp': values[1], 'objects': {}, 'leds': {}}
+        i = 2
+        for label in self.layout['objects']:
+            state['objects'][label] = values[i:i + n_o]
+            i += n_o
+        for label in self.layout['leds']:
+            state['leds'][label] = values[i:i + n_l]
+            i += n_l
+        return state
+
+    def receive(self, timeout=None):
+        """ Next state, None if none arrived within timeout seconds. """
+        self.socket.settimeout(timeout)
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                return None
+            state = self.decode(data)
+            if state is not None:
+                return state
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.socket.settimeout(remaining)
+
+    def latest(self):
+        """ Most recent state waiting in the socket buffer without blocking,
+        older ones are discarded. None if there is none.
+        """
+        self.socket.setblocking(False)
+        state = None
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except socket.error:
+                break
+            decoded = self.decode(data)
+            if decoded is not None:
+                state = decoded
+        return state
+
+    def close(self):
+        self.socket.close()
+        if self.kind == 'unix' and os.path.exists(self.source):
+            os.unlink(self.source)
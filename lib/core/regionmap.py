@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Rasterized regions.
+
+The area shapes (circles, rectangles, polygons) of all regions are drawn
+into a frame sized bitmask image, one bit per shape. Where a point lies is
+then a single array lookup, and all objects are located against all shapes
+in one vectorized operation per frame. The image is only redrawn when
+regions or shapes were added, removed, moved or (de)activated, which is
+detected by comparing a small key of the shape geometry every frame.
+
+Lines are not areas, their crossing test depends on the previous position
+and stays with the shape (see Shape.collision_check_line).
+
+Usage:
+    rmap = RegionMap()
+    rmap.update(tracker.rois, frame.img.shape[:2])
+    rmap.locate(tracker.oois)
+    rmap.contains(shape, obj)    # True, False or None if not rasterized
+"""
+
+import logging
+
+import numpy as np
+
+WORD_BITS = 64
+AREA_SHAPES = ('circle', 'rectangle', 'polygon')
+
+
+def rasterize(shape, size):
+    """
+    Pixels inside shape, as ((y0, y1, x0, x1), boolean array) clipped to
+    size (height, width). Same rules as the shape's collision check: circle
+    borders are inside, rectangle borders are not, polygons are even-odd.
+    None if nothing is inside.
+    """
+    h, w = size
+    if shape.shape == 'circle':
+        (cx, cy), r = shape.points[0], shape.radius
+        x0, x1 = int(np.floor(cx - r)), int(np.ceil(cx + r)) + 1
+        y0, y1 = int(np.floor(cy - r)), int(np.ceil(cy + r)) + 1
+    elif shape.shape == 'polygon':
+        x0, x1 = int(np.floor(shape.topleft_x)), int(np.ceil(shape.bottomright_x)) + 1
+        y0, y1 = int(np.floor(shape.topleft_y)), int(np.ceil(shape.bottomright_y)) + 1
+    elif shape.shape == 'rectangle':
+        x0, x1 = int(np.floor(shape.topleft_x)) + 1, int(np.ceil(shape.bottomright_x))
+        y0, y1 = int(np.floor(shape.topleft_y)) + 1, int(np.ceil(shape.bottomright_y))
+    else:
+        return None
+
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, w), min(y1, h)
+    if x0 >= x1 or y0 >= y1:
+        return None
+
+    if shape.shape == 'circle':
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        inside = (xx - cx) ** 2 + (yy - cy) ** 2 <= r * r
+    elif shape.shape == 'polygon':
+        inside = shape.polygon.raster(y0, y1, x0, x1)
+    else:
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        inside = (xx > shape.topleft_x) & (xx < shape.bottomright_x) & \
+                 (yy > shape.topleft_y) & (yy < shape.bottomright_y)
+    return (y0, y1, x0, x1), inside
+
+
+def geometry_key(rois):
+    """ Changes whenever the rasterized image would. """
+    return tuple((id(r), tuple((id(s), s.shape, s.active, tuple(s.points)) for s in r.shapes))
+                 for r in rois)
+
+
+class RegionMap:
+    """ Bitmask image of all area shapes of a list of regions. """
+
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+        self.key = None
+        self.size = None
+        # (words, height, width) uint64, bit i of word i // 64 is shape i
+        self.words = np.zeros((1, 0, 0), np.uint64)
+        self.shapes = []
+        self.rows = {}      # shape -> bit number
+        self.word_of = np.zeros(0, np.intp)
+        self.bit_of = np.zeros(0, np.uint64)
+        self.regions = {}   # region -> bit numbers of its area shapes
+
+        # result of locate: (shapes, objects) boolean array
+        self.inside = np.zeros((0, 0), bool)
+        self.columns = {}   # object -> column in inside
+        self.n_rebuilds = 0
+
+    def update(self, rois, size):
+        """ Redraw if regions, shapes or the frame size changed. """
+        key = geometry_key(rois)
+        if key != self.key or tuple(size) != self.size:
+            self.rebuild(rois, size)
+            self.key = key
+
+    def rebuild(self, rois, size):
+        self.size = tuple(size)
+        self.shapes = []
+        self.regions = {}
+        for r in rois:
+            rows = []
+            for s in r.shapes:
+                if s.active and s.shape in AREA_SHAPES:
+                    rows.append(len(self.shapes))
+                    self.shapes.append(s)
+            self.regions[r] = np.array(rows, np.intp)
+        self.rows = dict((s, i) for i, s in enumerate(self.shapes))
+
+        n = len(self.shapes)
+        self.words = np.zeros((max(1, (n + WORD_BITS - 1) // WORD_BITS), ) + self.size, np.uint64)
+        self.word_of = np.arange(n, dtype=np.intp) // WORD_BITS
+        self.bit_of = (np.arange(n) % WORD_BITS).astype(np.uint64)
+        for i, s in enumerate(self.shapes):
+            raster = rasterize(s, self.size)
+            if raster is None:
+                continue
+            (y0, y1, x0, x1), inside = raster
+            self.words[i // WORD_BITS, y0:y1, x0:x1][inside] |= np.uint64(1 << (i % WORD_BITS))
+        self.n_rebuilds += 1
+        self.log.debug("Rasterized %d shapes of %d regions", n, len(self.regions))
+
+    def lookup(self, points):
+        """
+        Boolean (shapes, points) array, True where the point lies inside
+        the shape. points is an (n, 2) array of x, y, points outside the
+        frame are inside nothing.
+        """
+        points = np.asarray(points, float).reshape(-1, 2)
+        result = np.zeros((len(self.shapes), len(points)), bool)
+        if not len(self.shapes) or not len(points):
+            return result
+        xs = np.round(points[:, 0]).astype(np.intp)
+        ys = np.round(points[:, 1]).astype(np.intp)
+        valid = (xs >= 0) & (xs < self.size[1]) & (ys >= 0) & (ys < self.size[0])
+        words = self.words[:, ys[valid], xs[valid]]
+        result[:, valid] = (words[self.word_of] >> self.bit_of[:, None]) & np.uint64(1) != 0
+        return result
+
+    def locate(self, objects):
+        """ Test the current position of all objects against all shapes. """
+        located = [o for o in objects if o.position is not None]
+        self.columns = dict((o, j) for j, o in enumerate(located))
+        self.inside = self.lookup([o.position[:2] for o in located])
+        return self.inside
+
+    def contains(self, shape, obj):
+        """ Whether obj was inside shape at the last locate. None if the shape
+        is not rasterized (lines) or the object was not located.
+        """
+        i = self.rows.get(shape)
+        j = self.columns.get(obj)
+        if i is None or j is None:
+            return None
+        return bool(self.inside[i, j])
+
+    def in_region(self, roi):
+        """ Boolean array of the located objects inside any area shape of roi. """
+        rows = self.regions.get(roi)
+        if rows is None or not len(rows):
+            return np.zeros(len(self.columns), bool)
+        return self.inside[rows].any(axis=0)
+
+    def shapes_at(self, point):
+        """ Area shapes containing point. """
+        hit = self.lookup([point])[:, 0]
+        return [self.shapes[i] for i in np.flatnonzero(hit)]
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed-rate output scheduler.
+
+Without scheduler, pin values go out whenever a frame is done, carrying all
+camera and processing jitter into the analog signals. The scheduler thread
+instead emits the values of all pins at a fixed rate. The tracking thread
+only updates the latest state: the value of each pin and, for DACs, its rate
+of change between the last two updates. At every tick position values on
+DACs are extrapolated linearly from that state (at most EXTRAPOLATION_LIMIT
+seconds, so a lost object does not run away). Other values, digital or raw
+like an orientation that wraps around, are held.
+
+Ticks are handed to the serial output thread (see serialout), which sends
+only what changed.
+"""
+
+import math
+import time
+import logging
+import threading
+
+OUTPUT_RATE = 500.0          # ticks per second
+EXTRAPOLATION_LIMIT = 0.05   # seconds after the last update values are extrapolated for
+MAX_VALUE = 4095             # DAC range, extrapolated values are clipped to it
+
+TYPE_DAC = 1
+
+
+class TimingStats:
+    """ Achieved tick rate and jitter (tick time minus scheduled time) in seconds. """
+
+    def __init__(self):
+        self.t_start = None
+        self.n_ticks = 0
+        self.n_missed = 0   # ticks skipped because the thread fell behind
+        self.jitter_sum = 0.0
+        self.jitter_sq_sum = 0.0
+        self.jitter_max = 0.0
+
+    def add(self, scheduled, actual):
+        if self.t_start is None:
+            self.t_start = actual
+        jitter = actual - scheduled
+        self.n_ticks += 1
+        self.jitter_sum += jitter
+        self.jitter_sq_sum += jitter * jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+
+    @property
+    def rate(self):
+        if self.t_start is None or self.n_ticks < 2:
+            return 0.0
+        return (self.n_ticks - 1) / max(1e-9, time.time() - self.t_start)
+
+    @property
+    def jitter_mean(self):
+        return self.jitter_sum / self.n_ticks if self.n_ticks else 0.0
+
+    @property
+    def jitter_std(self):
+        if not self.n_ticks:
+            return 0.0
+        mean = self.jitter_mean
+        return math.sqrt(max(0.0, self.jitter_sq_sum / self.n_ticks - mean * mean))
+
+    def as_dict(self):
+        return {'n_ticks': self.n_ticks,
+                'n_missed': self.n_missed,
+                'rate': self.rate,
+                'jitter_mean': self.jitter_mean,
+                'jitter_std': self.jitter_std,
+                'jitter_max': self.jitter_max}
+
+
+class OutputScheduler:
+    """ Emits [type, pin, value] instructions to output (anything with a
+    post method, e.g. serialout.SerialOutput) at a fixed rate.
+    """
+
+    def __init__(self, output, rate=OUTPUT_RATE, limit=EXTRAPOLATION_LIMIT, max_value=MAX_VALUE):
+        self.log = logging.getLogger(__name__)
+        self.output = output
+        self.period = 1.0 / rate
+        self.limit = limit
+        self.max_value = max_value
+
+        # (type, pin) -> [time of update, value, change per second]
+        self.state = {}
+        self.lock = threading.Lock()
+        self.stats = TimingStats()
+
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name='OutputScheduler')
+        self.thread.daemon = True
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def update(self, instructions, t=None, extrapolate=None):
+        """ New values from the tracking thread. extrapolate holds the
+        (type, pin) keys of values that change smoothly, by default all DACs.
+        """
+        if t is None:
+            t = time.time()
+        with self.lock:
+            for instr in instructions:
+                key = (instr[0], instr[1])
+                value = instr[2]
+                slope = 0.0
+                previous = self.state.get(key)
+                smooth = instr[0] == TYPE_DAC if extrapolate is None else key in extrapolate
+                if smooth and previous is not None and value is not None \
+                        and previous[1] is not None and t > previous[0]:
+                    slope = (value - previous[1]) / (t - previous[0])
+                self.state[key] = [t, value, slope]
+
+    def values(self, t):
+        """ Instructions for time t. """
+        instr = []
+        with self.lock:
+            for key, (t_update, value, slope) in self.state.iteritems():
+                if slope and value is not None:
+                    value += slope * min(t - t_update, self.limit)
+                    value = int(round(min(max(value, 0), self.max_value)))
+                instr.append([key[0], key[1], value])
+        return instr
+
+    def run(self):
+        next_tick = time.time()
+        while self.running:
+            now = time.time()
+            if next_tick > now:
+                time.sleep(next_tick - now)
+                now = time.time()
+            elif now - next_tick > self.period:
+                # fell behind, drop the ticks that were missed
+                missed = int((now - next_tick) / self.period)
+                self.stats.n_missed += missed
+                next_tick += missed * self.period
+            self.stats.add(next_tick, now)
+            instr = self.values(now)
+            if instr:
+                self.output.post(instr)
+            next_tick += self.period
+
+    def stop(self, timeout=1.0):
+        self.running = False
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Serial output thread with a latest-value mailbox.
+
+The tracking thread posts the values for all output pins every frame and
+returns immediately. A dedicated thread takes whatever is in the mailbox and
+writes it to the board. If a write blocks (full USB-serial buffer), values
+posted in the meantime replace older ones per pin, so once the port frees up
+only the most recent value of every pin is sent. Replaced, never sent values
+are counted as coalesced.
+"""
+
+import time
+import logging
+import threading
+
+LATENCY_WINDOW = 0.98  # smoothing of the running mean write latency
+
+
+class OutputStats:
+    """ Counters of an output thread. Latencies in seconds. """
+
+    def __init__(self):
+        self.n_posts = 0        # values posted by the tracking thread
+        self.n_sends = 0        # writes to the serial port
+        self.n_values = 0       # values written
+        self.n_coalesced = 0    # values replaced before they were written
+        self.n_failed = 0       # failed writes
+        self.latency_last = 0.0
+        self.latency_mean = 0.0
+        self.latency_max = 0.0
+
+    def add_latency(self, latency):
+        self.latency_last = latency
+        if self.n_sends == 1:
+            self.latency_mean = latency
+        else:
+            self.latency_mean = LATENCY_WINDOW * self.latency_mean + (1 - LATENCY_WINDOW) * latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class SerialOutput:
+    """ Owns the writes to one board. Instructions are [type, pin, value]
+    lists as taken by Arduino.send_updates, the mailbox holds the latest
+    value per (type, pin).
+    """
+
+    def __init__(self, device, name='SerialOutput'):
+        self.log = logging.getLogger(__name__)
+        self.device = device
+        self.mailbox = {}
+        self.condition = threading.Condition(threading.Lock())
+        self.stats = OutputStats()
+        self.running = False
+        # set by the thread when the device failed, checked by the owner
+        self.failed = False
+
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def post(self, instructions):
+        """ Hand the current pin values to the output thread, never blocks
+        on the port.
+        """
+        with self.condition:
+            for instr in instructions:
+                key = (instr[0], instr[1])
+                if key in self.mailbox:
+                    self.stats.n_coalesced += 1
+                self.mailbox[key] = instr[2]
+            self.stats.n_posts += len(instructions)
+            self.condition.notify()
+
+    def take(self):
+        """ Wait for values and empty the mailbox. """
+        with self.condition:
+            while self.running and not self.mailbox:
+                self.condition.wait()
+            mailbox, self.mailbox = self.mailbox, {}
+        return [[k[0], k[1], v] for k, v in sorted(mailbox.iteritems())]
+
+    def run(self):
+        while self.running:
+            instr = self.take()
+            if not instr:
+                continue
+            t = time.time()
+            ok = self.device.send_updates(instr)
+            latency = time.time() - t
+            self.stats.n_sends += 1
+            self.stats.n_values += len(instr)
+            self.stats.add_latency(latency)
+            if not ok:
+                self.stats.n_failed += 1
+                self.failed = True
+                self.running = False
+                self.log.error("Serial output failed, stopping output thread")
+
+    def stop(self, timeout=1.0):
+        """ Stop the thread. Values not yet written are dropped. """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Binary per-frame sidecar written next to recorded videos.
+
+One fixed size record per written frame: frame index, tickstamp and for each
+object x, y, orientation and speed, for each LED x and y. Missing values are
+stored as NaN. Records are collected and written to disk in blocks.
+
+File layout:
+    MAGIC, header length (uint32), JSON header, records...
+    index, trailer (written on close, see binlog.write_index)
+
+The index has one entry per written block: number of the first record in the
+block, its frame index and its tickstamp. Records are sorted by both, so a
+time or frame range is found by binary search without touching the records.
+
+Reading back:
+    header, records = read_sidecar('video.avi.sidecar')
+    records['objects'][:, 0, 0]  # x position of first object
+
+    sc = Sidecar('video.avi.sidecar')
+    part = sc.between(60000, 120000)
+"""
+
+import json
+import mmap
+import struct
+import logging
+
+import numpy as np
+
+import binlog
+
+MAGIC = 'SPTSIDE1'
+EXTENSION = '.sidecar'
+BLOCK_SIZE = 64 * 1024  # bytes collected before hitting the disk
+
+OBJECT_FIELDS = ('x', 'y', 'orientation', 'speed')
+LED_FIELDS = ('x', 'y')
+
+# fields of a block index entry
+INDEX_FIELDS = ('record', 'index', 'tickstamp')
+RECORD_KEY = struct.Struct('<Iq')  # leading index and tickstamp of every record
+
+NAN = float('nan')
+
+
+def record_dtype(n_objects, n_leds):
+    """ numpy dtype matching the packed record layout. """
+    return np.dtype([('index', '<u4'),
+                     ('tickstamp', '<i8'),
+                     ('objects', '<f4', (n_objects, len(OBJECT_FIELDS))),
+                     ('leds', '<f4', (n_leds, len(LED_FIELDS)))])
+
+
+def _value(v):
+    return NAN if v is None else v
+
+
+class RecordPacker:
+    """ Packs the state of a fixed list of objects and LEDs into one record.
+    The layout is fixed when recording starts; objects added later are not
+    included, objects removed later keep being written as NaN.
+    """
+
+    def __init__(self, objects, leds):
+        self.objects = list(objects)
+        self.leds = list(leds)
+        self.struct = struct.Struct('<Iq' + 'f' * (len(OBJECT_FIELDS) * len(self.objects) +
+                                                   len(LED_FIELDS) * len(self.leds)))
+
+    @property
+    def labels(self):
+        return [str(o.label) for o in self.objects], [str(l.label) for l in self.leds]
+
+    def pack(self, frame):
+        values = [frame.index, frame.tickstamp]
+        for o in self.objects:
+            values.extend([_value(o.getPositionX()), _value(o.getPositionY()),
+                           _value(o.getOrientation()), _value(o.getSpeed())])
+        for l in self.leds:
+            p = l.position
+            if p is None:
+                values.extend([NAN, NAN])
+            else:
+                values.extend([p[0], p[1]])
+        return self.struct.pack(*values)
+
+
+class SidecarWriter:
+    """ Appends packed records to the sidecar file, block-wise. """
+
+    def __init__(self, path, labels, **info):
+        self.log = logging.getLogger(__name__)
+        self.path = path
+        self.n_records = 0
+        self.buffer = []
+        self.buffered = 0
+        self.index = []
+
+        object_labels, led_labels = labels
+        header = dict(info)
+        header.update({'objects': object_labels,
+                       'object_fields': OBJECT_FIELDS,
+                       'leds': led_labels,
+                       'led_fields': LED_FIELDS})
+        header = json.dumps(header)
+
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.file.write(struct.pack('<I', len(header)))
+        self.file.write(header)
+
+    def append(self, record):
+        self.buffer.append(record)
+        self.buffered += len(record)
+        self.n_records += 1
+        if self.buffered >= BLOCK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            first = self.n_records - len(self.buffer)
+            self.index.append((first, ) + RECORD_KEY.unpack_from(self.buffer[0]))
+            self.file.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        binlog.write_index(self.file, self.index, len(INDEX_FIELDS))
+        self.file.close()
+        self.file = None
+        self.log.debug("Closed sidecar %s with %d records", self.path, self.n_records)
+
+
+def read_header(f):
+    """ Read header from open file, leaves file positioned at the first record. """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise IOError("Not a Spotter sidecar file")
+    n_header = struct.unpack('<I', f.read(4))[0]
+    return json.loads(f.read(n_header))
+
+
+class Sidecar:
+    """ Memory mapped reader. Records are returned as views into the file,
+    ranges are located through the block index (or, for files that were not
+    closed properly, by binary search over the records directly).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.header = read_header(self.file)
+        start = self.file.tell()
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.dtype = record_dtype(len(self.header['objects']), len(self.header['leds']))
+        index, data_end = binlog.read_index(self.mm)
+        n = (data_end - start) // self.dtype.itemsize
+        self.records = np.frombuffer(self.mm, self.dtype, n, start)
+        # one array per index field, e.g. self.blocks['tickstamp']
+        self.blocks = None if index is None else dict((f, index[:, i]) for i, f in enumerate(INDEX_FIELDS))
+
+    def __len__(self):
+        return len(self.records)
+
+    def locate(self, value, field):
+        """ Number of the first record with field >= value. """
+        if self.blocks is None:
+            return int(np.searchsorted(self.records[field], value, 'left'))
+        keys = self.blocks[field]
+        k = int(np.searchsorted(keys, value, 'right')) - 1
+        if k < 0:
+            return 0
+        lo = int(self.blocks['record'][k])
+        hi = int(self.blocks['record'][k+1]) if k + 1 < len(keys) else len(self.records)
+        return lo + int(np.searchsorted(self.records[field][lo:hi], value, 'left'))
+
+    def slice(self, start=None, stop=None, field='tickstamp'):
+        lo = 0 if start is None else self.locate(start, field)
+        hi = len(self.records) if stop is None else self.locate(stop, field)
+        return self.records[lo:max(lo, hi)]
+
+    def between(self, t_start=None, t_stop=None):
+        """ Records with t_start <= tickstamp < t_stop. """
+        return self.slice(t_start, t_stop, 'tickstamp')
+
+    def frames(self, i_start=None, i_stop=None):
+        """ Records with i_start <= frame index < i_stop. """
+        return self.slice(i_start, i_stop, 'index')
+
+    def iter_blocks(self, t_start=None, t_stop=None, n_records=BLOCK_SIZE // 64):
+        """ Stream a time range in pieces of at most n_records records. """
+        part = self.between(t_start, t_stop)
+        for i in xrange(0, len(part), n_records):
+            yield part[i:i+n_records]
+
+    def close(self):
+        self.records = None
+        self.mm.close()
+        self.file.close()
+
+
+def read_sidecar(path):
+    """ Load a sidecar in one call. Returns header dict and a numpy record
+    array with fields index, tickstamp, objects (n, n_objects, 4) and
+    leds (n, n_leds, 2).
+    """
+    sc = Sidecar(path)
+    records = sc.records.copy()
+    sc.close()
+    return sc.header, records
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled dispatch table of the slots bound to output pins.
+
+Which slot drives which pin only changes when pins are attached or
+detached, boards come and go, or objects and regions are added. The table
+is compiled at those moments into flat arrays: pin type, address, board and
+value kind per entry, plus the value getters. Every frame the values are
+gathered into a preallocated array (NaN for None) and converted for all
+pins at once, digital thresholds and DAC values alike, then handed to the
+boards. Missing values and values outside the DAC range are dealt with by
+masks over the whole array, not per slot.
+
+Kinds of entries:
+    RAW      value passed on as it is (object signals on DACs)
+    DIGITAL  HIGH if the value is true, else LOW
+    DAC      position coordinate scaled to the DAC range (state_idx is the axis)
+"""
+
+import logging
+
+import numpy as np
+
+KIND_RAW = 0
+KIND_DIGITAL = 1
+KIND_DAC = 2
+
+DIGITAL_HIGH = 100  # pin HIGH if data > 0
+DIGITAL_LOW = 0
+
+NAN = float('nan')
+TYPE_DAC = 1
+
+
+class SlotTable:
+    """ Flat table of slot -> pin bindings. """
+
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+        self.key = None
+        self.n_compiles = 0
+        self.n_clipped = 0  # values outside the DAC range, sent as the nearest limit
+        self.compile([], [])
+
+    def stale(self, key):
+        """ True if the table was compiled for a different key. """
+        return key != self.key
+
+    def compile(self, slots, boards, key=None):
+        """ Build the table for slots bound to pins of boards. Slots whose
+        pin is not on any of the boards are left out.
+        """
+        self.key = key
+        self.slots = []
+        self.boards = list(boards)
+        board_idx, calls, kinds, types, addrs, labels, axes, smooth = [], [], [], [], [], [], [], []
+        for slot in slots:
+            if slot.pin is None:
+                continue
+            for b, board in enumerate(self.boards):
+                if slot.pin in board.device.pins[slot.pin.type]:
+                    break
+            else:
+                continue
+            self.slots.append(slot)
+            board_idx.append(b)
+            if slot.state_idx is None:
+                kind = KIND_RAW
+            elif slot.type == 'digital':
+                kind = KIND_DIGITAL
+            elif slot.type == 'dac':
+                kind = KIND_DAC
+            else:
+                kind = KIND_RAW
+            # DAC slots return a point, the entry takes the coordinate of its axis
+            calls.append((slot.state, slot.state_idx, slot.state_idx if kind == KIND_DAC else None))
+            kinds.append(kind)
+            types.append(slot.pin.type_id)
+            addrs.append(slot.pin.addr)
+            labels.append(slot.pin.label)
+            axes.append(slot.state_idx if kind == KIND_DAC else 0)
+            smooth.append(kind == KIND_DAC or slot.positional)
+
+        self.calls = calls
+        self.types = types
+        self.addrs = addrs
+        self.kinds = np.array(kinds, np.int8)
+        self.axes = np.array(axes, np.intp)
+        self.board_idx = np.array(board_idx, np.intp)
+        self.values = np.empty(len(calls), float)
+
+        self.digital = np.flatnonzero(self.kinds == KIND_DIGITAL)
+        self.dac = np.flatnonzero(self.kinds == KIND_DAC)
+        # every entry on a DAC pin, scaled or raw, is clipped to its range
+        self.on_dac = np.array(types, np.int8) == TYPE_DAC
+        # digital entries whose changes are logged, and their pin labels
+        self.logged_digital = np.array([i for i in self.digital if self.slots[i].logged], np.intp)
+        self.digital_labels = [labels[i] for i in self.logged_digital]
+        # entries of each board
+        self.entries = [np.flatnonzero(self.board_idx == b).tolist() for b in xrange(len(self.boards))]
+        # (type, addr) of the position coordinates of each board, scaled or
+        # from positional slots, the only values worth extrapolating; other
+        # raw values like orientation may wrap
+        self.positional = dict((board, frozenset((types[i], addrs[i]) for i in entries if smooth[i]))
+                               for board, entries in zip(self.boards, self.entries))
+        self.n_compiles += 1
+        self.log.debug("Compiled %d slots on %d boards", len(calls), len(self.boards))
+
+    def __len__(self):
+        return len(self.calls)
+
+    def gather(self):
+        """ Read the current value of every slot, NaN for None. """
+        values = self.values
+        for i, (state, arg, axis) in enumerate(self.calls):
+            v = state() if arg is None else state(arg)
+            if v is not None and axis is not None:
+                v = v[axis]
+            values[i] = NAN if v is None else v
+        return values
+
+    def convert(self, values, scale_dac, max_dac):
+        """ Output values of all entries as ints, None (NaN) is 0.
+        scale_dac(values, axes) scales arrays of position coordinates to the
+        DAC range, values on DAC pins are clipped to 0 - max_dac.
+        """
+        missing = np.isnan(values)
+        out = np.where(missing, 0, values)
+        if len(self.digital):
+            out[self.digital] = np.where(values[self.digital] > 0, DIGITAL_HIGH, DIGITAL_LOW)
+        if len(self.dac):
+            out[self.dac] = np.where(missing[self.dac], 0, scale_dac(out[self.dac], self.axes[self.dac]))
+        outside = self.on_dac & ((out < 0) | (out > max_dac))
+        if outside.any():
+            self.n_clipped += int(np.count_nonzero(outside))
+            out[outside] = np.clip(out[outside], 0, max_dac)
+        return out.astype(np.int64)
+
+    def instructions(self, out):
+        """ [type, addr, value] lists per board, as (board, list) pairs. """
+        out = out.tolist()
+        types, addrs = self.types, self.addrs
+        return [(board, [[types[i], addrs[i], out[i]] for i in entries])
+                for board, entries in zip(self.boards, self.entries) if entries]
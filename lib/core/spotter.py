@@ -41,9 +41,19 @@ from lib.core import grabber, tracker, writer, chatter
 import pickle
 from PyQt4 import QtCore
 import datalog
+import prebuffer
+import sidecar
+import eventlog
+import publisher
+import slottable
+import trackables
 
 timings_filename = 'tracking_3LEDs.p'
-DATALOG_TIMEOUT= 20 ###change this to increase/reduce data log frequency
+DATALOG_TIMEOUT= 0 ###frames skipped between data log samples, 0 logs every frame
+DATALOG_FORMAT = 'binary'  # 'binary' (columnar, see binlog), 'text' (json lines) or 'text.gz'
+DATALOG_COMPRESSION = 6    # zlib level of data log blocks, 0 off, 1 fast - 9 small
+EVENTLOG = True            # write region and pin events next to the data log
+PUBLISH_ADDRESS = None     # publish per-frame state, e.g. 'udp://239.255.42.99:5555' or 'unix:///tmp/spotter.sock'
 
 class Spotter:
 
@@ -53,6 +63,11 @@ class Spotter:
     tracker = None
     chatter = None
     dlogger=None
+    elogger = None          # writes the event stream while data logging
+    events = None           # detects region transitions and pin changes
+    publisher = None        # streams per-frame state to local subscribers
+    trigger_capture = None  # pre-trigger ring buffer, only used for triggered recordings
+    record_packer = None    # packs per-frame sidecar records while recording
 
     # state variables
     record_to_file = True
@@ -104,14 +119,21 @@ class Spotter:
         self.log.debug('Instantiating writer...')
         self.writer_queue = multiprocessing.Queue(16)
         self.writer_pipe, child_pipe = multiprocessing.Pipe()
+        # liveness lives in shared memory, the pipe only carries commands
+        self.heartbeat = multiprocessing.Value('L', 0, lock=False)
 
         self.writer = multiprocessing.Process(target=writer.Writer,
                                               args=(self.grabber.fps, self.grabber.size,
-                                                    self.writer_queue, child_pipe,))
+                                                    self.writer_queue, child_pipe,
+                                                    self.heartbeat,))
         self.log.debug('Starting writer...')
         self.writer.start()
         self.log.debug('Instantiating data logger...')
         self.dlogger=datalog.DataLogger()
+        self.elogger = datalog.DataLogger()
+        self.events = eventlog.EventDetector()
+        if PUBLISH_ADDRESS:
+            self.start_publisher(PUBLISH_ADDRESS)
 
         # tracker object finds LEDs in frames
         self.log.debug('Instantiating tracker...')
@@ -119,7 +141,8 @@ class Spotter:
 
         # chatter handles serial communication
         self.log.debug('Instantiating chatter...')
-        self.chatter = chatter.Chatter(serial, auto=True)
+        # connects in the background, the GUI is up before the board answers
+        self.chatter = chatter.Chatter(serial, auto=True, block=False)
 
         # self.timer2 = QtCore.QTimer()
         # self.timer2.timeout.connect(self.update)
@@ -127,20 +150,12 @@ class Spotter:
         # self.timer2.start(SPOTTER_REFRESH_INTERVAL)
         self.stopwatch = QtCore.QElapsedTimer()
         self.stopwatch.start()
-        p=self.chatter.pins('digital')
-        if p is not None and len(p)>0:
-            self.fpstest = self.tracker.trackFPS(p[-1])
-        else:
-            self.fpstest=None
+        # pin is attached once the board is connected, see spotterQt.trackFPS
+        self.fpstest = self.tracker.trackFPS(None)
+        # slots bound to pins, recompiled when bindings change
+        self.slot_table = slottable.SlotTable()
 
     def update(self):
-        slots = []
-        logobjects = []
-
-        #if it outputs the Frame signal on D3
-        if self.FPStest == True and self.fpstest!=None:
-            slots.append(self.fpstest.slot)
-
         # Get new frame
         self.newest_frame = self.grabber.grab()
         if self.newest_frame is not None:
@@ -162,63 +177,86 @@ class Spotter:
             self.tracker.track_marker(self.newest_frame, method='hsv_thresh',
                                        scale=self.scale_tracking, elapsedtime=self.spotterelapsed)
 
-            messages = []
             # Update positions of all objects
             for o in self.tracker.oois:
                 #calculates marker position from LED's to object
                 #with the kalman filter: updates the coordinates of the object after smoothing, predicts missing coordinates
                 o.update_values(self.spotterelapsed)
 
-                #updates the output values to the Arduino
-                o.update_slots(self.chatter)
-
-                slots.extend(o.linked_slots)
-                messages.append('\t'.join([self.newest_frame.time_text,
-                                           #str(self.newest_frame.tickstamp),
-                                           str(o.label),
-                                           str(o.position)]))
-                #print o.linked_slots
-            for l in self.tracker.leds:
-                messages.append('\t'.join([self.newest_frame.time_text,
-                                           #str(self.newest_frame.tickstamp),
-                                           str(l.label),
-                                           str(l.position)]))
+            # attach slots to pins and recompile the output table, only if bindings changed
+            self.update_bindings()
+            slots = self.slot_table.slots
 
             # Check Object-Region collisions
+            region_map, shape_index = self.tracker.locate_objects(self.newest_frame)
             for r in self.tracker.rois:
-                r.update_slots(self.chatter)
                 r.update_state()
-                slots.extend(r.linked_slots)
-            self.chatter.update_pins(slots)
+                r.update_collisions(region_map, shape_index, self.newest_frame)
+            self.chatter.update_pins(self.slot_table)
+
+            # transitions are detected every frame, whether logged or not
+            events = self.events.update(self.newest_frame, self.tracker.rois, self.chatter.digital_states)
+            if events and self.datalogging:
+                self.elogger.update(slots, events)
+
+            if self.publisher is not None:
+                self.publisher.publish(self.newest_frame, self.tracker.oois, self.tracker.leds)
 
             #if logging enabled, it adds a line in the log
             if self.datalogging==True:
                 if self.datalog_counter == 0:
                     self.datalog_counter = DATALOG_TIMEOUT
-                    logobjects.append([self.newest_frame.time_text, [(str(o.label), str(o.getPositionX()),
-                                                      str(o.getPositionY()), str(o.getSpeed()),
-                                                      str(o.getOrientation()),
-                                                      str(o.getPositionY()), str(o.getSpeed()),
-                                                      str(o.getOrientation()),
-                                                      [(str(l.label), str(l.position)) for l in
-                                                       o.getLinkedLEDs()]) for o in self.tracker.oois]])
-                    self.dlogger.update(slots, logobjects)
-                    print ('logging')
+                    # formatting and file access happen in the logger thread
+                    self.dlogger.update(slots, self.dlogger.snapshot(self.newest_frame, self.tracker.oois))
                 else:
                     self.datalog_counter=self.datalog_counter-1
 
             # Check on writer process to prevent data loss and preserve reference
             if self.check_writer():
                 if self.recording:
-                    self.writer_pipe.send(['record'])
-                    item = (copy.deepcopy(self.newest_frame), copy.deepcopy(messages))
-                    self.writer_queue.put(item)
+                    item = (copy.deepcopy(self.newest_frame), self.record_packer.pack(self.newest_frame))
+                    if self.trigger_capture is None:
+                        self.writer_queue.put(item)
+                    else:
+                        self.trigger_capture.update(item)
+                        self.trigger_capture.flush_to(self.writer_queue)
 #               time.sleep(0.001)  # required, or may crash?
 
-        # FIXME: Blocks if buffer runs full when writer crashes/closes
-        self.writer_pipe.send(['alive'])
+        # keeps the writer watchdog happy, wraps around silently
+        self.heartbeat.value += 1
         return self.newest_frame
 
+    def binding_key(self):
+        """ Changes whenever slots may attach to pins or the output table
+        has to be recompiled.
+        """
+        return (trackables.Slot.bindings, tuple(id(b) for b in self.chatter.boards),
+                tuple((id(o), len(o.slots)) for o in self.tracker.oois),
+                tuple((id(r), len(r.slots)) for r in self.tracker.rois),
+                self.FPStest)
+
+    def update_bindings(self):
+        """ Let slots with pin preferences grab their pins and compile the
+        slots linked to pins into the output table.
+        """
+        if not self.slot_table.stale(self.binding_key()):
+            return
+        for o in self.tracker.oois:
+            o.update_slots(self.chatter)
+        for r in self.tracker.rois:
+            r.deal_pin_prefs()
+            r.update_slots(self.chatter)
+
+        slots = []
+        #if it outputs the Frame signal on D3
+        if self.FPStest == True and self.fpstest!=None:
+            slots.append(self.fpstest.slot)
+        for o in self.tracker.oois:
+            slots.extend(o.linked_slots)
+        for r in self.tracker.rois:
+            slots.extend(r.linked_slots)
+        self.slot_table.compile(slots, self.chatter.boards, self.binding_key())
+
     @property
     def source_type(self):
         return self.newest_frame.source_type if self.newest_frame else None
@@ -227,22 +265,70 @@ class Spotter:
         """ True if alive """
         return self.writer.is_alive()
 
-    def start_writer(self, filename=None):
+    def start_writer(self, filename=None, triggered=False, pre_seconds=prebuffer.PRE_TRIGGER_SECONDS,
+                     post_seconds=prebuffer.POST_TRIGGER_SECONDS, compress=False):
+        """
+        Start recording. If triggered, frames are held in a pre-trigger ring
+        buffer and only written around events, by default any object
+        colliding with any region, including regions added later on.
+        """
         size = (self.newest_frame.img.shape[1], self.newest_frame.img.shape[0])
-        self.writer_pipe.send(['start', size, filename])
+        if triggered:
+            fps = self.grabber.fps if self.grabber.fps else grabber.fps_default
+            self.trigger_capture = prebuffer.TriggeredCapture(fps, pre_seconds, post_seconds, compress)
+            self.trigger_capture.add_trigger(prebuffer.AnyRegionTrigger(self.tracker.rois))
+        else:
+            self.trigger_capture = None
+        # sidecar layout is fixed for the duration of the recording
+        self.record_packer = sidecar.RecordPacker(self.tracker.oois, self.tracker.leds)
+        self.writer_queue.put([writer.START, size, filename, self.record_packer.labels])
         self.recording = True
 
+    def add_recording_trigger(self, trigger):
+        """ Add a trigger (callable, e.g. prebuffer.RegionTrigger) to a triggered recording. """
+        if self.trigger_capture is None:
+            return None
+        return self.trigger_capture.add_trigger(trigger)
+
     def stop_writer(self):
-        self.writer_pipe.send(['stop'])
+        if self.trigger_capture is not None:
+            # frames of an ongoing event still have to reach the writer
+            self.trigger_capture.flush_to(self.writer_queue, block=True)
+            self.trigger_capture = None
+        # stop travels behind the last frame, so the writer writes everything queued before
+        self.writer_queue.put(writer.STOP)
         self.recording = False
 
     def stop_datalog(self):
         self.datalogging=False
-
-    def start_datalog(self, filename=None):
-        self.dlogger.start(filename)
+        self.dlogger.stop()
+        self.elogger.stop()
+
+    def start_datalog(self, filename=None, fmt=DATALOG_FORMAT, compression=DATALOG_COMPRESSION):
+        self.dlogger.start(filename, fmt, self.tracker.oois, self.tracker.leds, compression)
+        if EVENTLOG:
+            # events go next to the data log, same name
+            destination = self.dlogger.destination
+            ext = datalog.FORMATS[fmt].extension
+            self.elogger.start(destination[:-len(ext)] + eventlog.EventLog.extension, 'events')
         self.datalogging=True
 
+    def start_publisher(self, address=None):
+        self.stop_publisher()
+        if address is None:
+            address = publisher.ADDRESS
+        self.publisher = publisher.Publisher(address)
+        self.log.info("Publishing state to %s", address)
+
+    def stop_publisher(self):
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+
+    @property
+    def datalog_extension(self):
+        return datalog.FORMATS[DATALOG_FORMAT].extension
+
     def exit(self):
         """ Graceful exit. Ha. Ha. Ha. Bottle of root beer anyone? """
         # closing grabber is straight forward, will release capture object
@@ -253,6 +339,13 @@ class Spotter:
         if self.tracker is not None:
             self.tracker.close()
 
+        # data logger may still have queued samples to write
+        if self.dlogger is not None:
+            self.dlogger.stop()
+        if self.elogger is not None:
+            self.elogger.stop()
+        self.stop_publisher()
+
         # chatter HAS to close serial connection or all hell breaks loose!
         if self.chatter is not None:
             self.chatter.close()
@@ -8,13 +8,18 @@ Classes related to tracking.
 
 import math
 import random
+import numpy as np
 import lib.utilities as utils
 import lib.geometry as geom
 import kalmanfilter as kfilter
+import occupancy
 import logging
 
 SENSITIVITY = 0
 HIST_BUFFER = 3000  # number of values to be saved in the history arrays
+STEP_LOOKBACK = 30  # frames to look back for the previous position of a movement
+OCCUPANCY_BIN = 8          # pixels per bin of the occupancy maps of objects, None disables them
+OCCUPANCY_SPEED = False    # also accumulate speed per bin
 
 
 class Shape:
@@ -23,13 +28,15 @@ class Shape:
     Not sure about the color parameter, I think it better if all shapes in a
     ROI have the same color, to keep them together as one ROI.
     points: list of points defining the shape. Two for rectangle and circle,
+    the vertices for polygons.
     """
 
-    # TODO: n-polygon and collision detection
     def __init__(self, shape, points=None, label=None):
         self.active = True
         self.selected = False
         self.collision_check = None
+        # gridindex.GridIndex the shape is registered in, if any
+        self.index = None
 
         self.shape = shape.lower()
         self.label = label
@@ -43,21 +50,37 @@ class Shape:
             self.points = [points[0], (int(points[0][0]), points[0][1] + self.radius)]
             self.collision_check = self.collision_check_circle
         elif shape == 'rectangle':
-            if self.points is not None:
-                self.topleft_x = min(self.points[0][0], self.points[1][0])
-                self.topleft_y = min(self.points[0][1], self.points[1][1])
-                self.bottomright_y = max(self.points[0][1], self.points[1][1])
-                self.bottomright_x = max(self.points[0][0], self.points[1][0])
             self.collision_check = self.collision_check_rectangle
-
         elif shape == 'line':
+            self.crossing = None
+            self.collision_check = self.collision_check_line
+        elif shape == 'polygon':
+            self.polygon = None
+            self.collision_check = self.collision_check_polygon
+        self.update_bounds()
+
+    def update_bounds(self):
+        """ Recompute the values the collision checks use from the points,
+        after creation and every move.
+        """
+        if self.points is None:
+            return
+        if self.shape == 'circle':
+            self.radius_sq = geom.distance(self.points[0], self.points[1]) ** 2
+            return
+        if self.shape == 'polygon':
+            self.polygon = geom.Polygon(self.points)
+            self.topleft_x, self.topleft_y = self.polygon.xmin, self.polygon.ymin
+            self.bottomright_x, self.bottomright_y = self.polygon.xmax, self.polygon.ymax
+            return
+
+        self.topleft_x = min(self.points[0][0], self.points[1][0])
+        self.topleft_y = min(self.points[0][1], self.points[1][1])
+        self.bottomright_y = max(self.points[0][1], self.points[1][1])
+        self.bottomright_x = max(self.points[0][0], self.points[1][0])
 
-            self.prev_crossprod = None
+        if self.shape == 'line':
             # rectangle around the line segment
-            self.topleft_x = min(self.points[0][0], self.points[1][0])
-            self.topleft_y = min(self.points[0][1], self.points[1][1])
-            self.bottomright_y = max(self.points[0][1], self.points[1][1])
-            self.bottomright_x = max(self.points[0][0], self.points[1][0])
             # in case of a vertical line
             if abs(self.topleft_x - self.bottomright_x) < 20:
                 if self.topleft_x >= 10:
@@ -74,16 +97,20 @@ class Shape:
                     self.topleft_y = 0
                 self.bottomright_y = self.bottomright_y + 10
 
-            self.collision_check = self.collision_check_line
-
     def move(self, dx, dy):
         """ Move the shape relative to current position. """
         for i, p in enumerate(self.points):
             self.points[i] = (p[0] + dx, p[1] + dy)
+        self.update_bounds()
+        if self.index is not None:
+            self.index.update(self)
 
     def move_to(self, points):
         """ Move the shape to a new absolute position. """
         self.points = points
+        self.update_bounds()
+        if self.index is not None:
+            self.index.update(self)
 
     @property
     def radius(self):
@@ -95,11 +122,9 @@ class Shape:
         collision by comparing distance between center and point of object with
         radius.
         """
-        distance = geom.distance(self.points[0], point)
-        if self.active and (distance <= self.radius):
-            return True
-        else:
-            return False
+        dx = point[0] - self.points[0][0]
+        dy = point[1] - self.points[0][1]
+        return self.active and (dx * dx + dy * dy <= self.radius_sq)
 
     def collision_check_rectangle(self, point):
         """ Rectangle points
@@ -108,33 +133,22 @@ class Shape:
         y_in_interval = (point[1] > self.topleft_y) and (point[1] < self.bottomright_y)
         return self.active and x_in_interval and y_in_interval
 
-    def collision_check_line(self, point):
-        """ Line segment collision checking:
-        Step 1: Calculating crossproduct of the vector from point (C) to start point (A), and the vector of the line segment (AB).
-        Step 2: Multiply the cross product with the previous frame's cross product: if the result is negative, the colinearity line was crossed
-        Step 3: Check if point C is within the rectangle around the line segment. """
-        # checking if they are colinear
-        a = self.points[0]
-        b = self.points[1]
-        crossprod = (point[1] - a[1]) * (b[0] - a[0]) - (point[0] - a[0]) * (b[1] - a[1])
-        # print crossprod
-        if self.prev_crossprod is not None:
-            if crossprod * self.prev_crossprod <= 0:
-                crossing = True
-                # print "crossing"
-                self.prev_crossprod = crossprod
-                x_in_interval = (point[0] > self.topleft_x) and (point[0] < self.bottomright_x)
-                y_in_interval = (point[1] > self.topleft_y) and (point[1] < self.bottomright_y)
-                # ret=self.active and x_in_interval and y_in_interval and crossing
-                # print ret
-
-                return self.active and x_in_interval and y_in_interval and crossing
-            else:
-                self.prev_crossprod = crossprod
-                return False
-        else:
-            self.prev_crossprod=crossprod
+    def collision_check_polygon(self, point):
+        """ Polygon points: vertices in order. Bounding box first, then the
+        precomputed edge table.
+        """
+        return self.active and self.polygon.contains_point(point)
+
+    def collision_check_line(self, point, previous=None):
+        """ Line crossing: the movement from the previous position to point
+        intersects the line segment. The fraction of that movement at which
+        it does is kept in self.crossing, to interpolate the crossing time.
+        """
+        self.crossing = None
+        if previous is None or not self.active:
             return False
+        self.crossing = geom.segment_crossing(previous, point, self.points[0], self.points[1])
+        return self.crossing is not None
 
 class Mask:
     """ Geometrical shape that comprise Blind spots. Blind spots can be made of several
@@ -148,8 +162,21 @@ class Mask:
         self.label = label
 
         self.points = points
-        self.p1 = (int(points[0][0]), int(points[0][1]))
-        self.p2 = (int(points[1][0]), int(points[1][1]))
+        self.update_bounds()
+
+    def update_bounds(self):
+        """ Integer coordinates for drawing the mask into frames. """
+        self.p1 = (int(self.points[0][0]), int(self.points[0][1]))
+        self.p2 = (int(self.points[1][0]), int(self.points[1][1]))
+        if self.shape == 'polygon':
+            self.polygon = geom.Polygon(self.points)
+            self.contour = np.round(self.polygon.vertices).astype(np.int32)
+
+    def move(self, dx, dy):
+        """ Move the mask relative to current position. """
+        for i, p in enumerate(self.points):
+            self.points[i] = (p[0] + dx, p[1] + dy)
+        self.update_bounds()
 
     @property
     def radius(self):
@@ -227,7 +254,11 @@ class LED(Marker):
         self.pos_hist = []
 
 class Slot:
-    def __init__(self, label, slot_type, state=None, state_idx=None, ref=None):
+    # counts pin attachments and detachments of all slots, compiled slot
+    # tables are rebuilt when it changes
+    bindings = 0
+
+    def __init__(self, label, slot_type, state=None, state_idx=None, ref=None, positional=False):
         # While nice, should be used for style, not for identity testing
         # FIXME: Use instance comparisons vs. label comparisons
         self.label = label
@@ -246,18 +277,24 @@ class Slot:
         # TODO: Unnecessary with proper use of @property decorators
         self.state_idx = state_idx
         self.ref = ref  # reference to object representing slot
+        # value is a position coordinate, changes smoothly between frames
+        self.positional = positional
+        # digital changes show up in the event log
+        self.logged = True
 
     def attach_pin(self, pin):
         if self.pin and self.pin.slot:
             self.detach_pin()
         self.pin = pin
         self.pin.slot = self
+        Slot.bindings += 1
 
     def detach_pin(self):
         print "we need to detach the signal here"
         # self.pin.slot.state=False
         self.pin.slot = None
         self.pin = None
+        Slot.bindings += 1
 
     def __del__(self):
         print "Removing slot", self
@@ -315,6 +352,12 @@ class ObjectOfInterest:
         self.posGuessing=False
         self.def_window = 25 #minimum window size for the adaptive window
 
+        # time spent in each bin of the frame over the whole session
+        self.occupancy = None
+        self.show_occupancy = False
+        if OCCUPANCY_BIN:
+            self.reset_occupancy(OCCUPANCY_BIN, OCCUPANCY_SPEED)
+
         # the slots for these properties/signals are greedy for pins
         if magnetic_signals is None:
             self.magnetic_signals = []
@@ -322,8 +365,8 @@ class ObjectOfInterest:
             self.magnetic_signals = magnetic_signals
 
         # listed order important. First come, first serve
-        self.slots = [Slot('x position', 'dac', self.getPositionX),
-                      Slot('y position', 'dac', self.getPositionY),
+        self.slots = [Slot('x position', 'dac', self.getPositionX, positional=True),
+                      Slot('y position', 'dac', self.getPositionY, positional=True),
                       Slot('head orientation ', 'dac', self.getOrientation),
                       Slot('speed', 'dac', self.getSpeed),
                       Slot('movement direction ', 'dac', self.getMovementDir),
@@ -356,6 +399,14 @@ class ObjectOfInterest:
             roi=[(0, 0), (self.max_x, self.max_y)] if l.fixed_pos else roi
             l.search_roi.move_to(roi)
 
+    def reset_occupancy(self, bin_size=None, speed_weighted=None):
+        """ Start a new occupancy map, optionally with another resolution. """
+        if bin_size is None:
+            bin_size = self.occupancy.bin_size if self.occupancy else OCCUPANCY_BIN
+        if speed_weighted is None:
+            speed_weighted = self.occupancy.speed_weighted if self.occupancy else OCCUPANCY_SPEED
+        self.occupancy = occupancy.OccupancyMap((self.max_x + 1, self.max_y + 1), bin_size, speed_weighted)
+
     def enable_filter(self):
         self.filterEnabled = True
 
@@ -401,6 +452,9 @@ class ObjectOfInterest:
             self.add_to_hist(coords, theta, sp, movdir, angvel, elapsedtime)
             self.update_searchROI()
 
+        if self.occupancy is not None:
+            self.occupancy.update(self.position, elapsedtime, self.getSpeed())
+
     def update_slots(self, chatter):
         for slot in self.slots:
             for ms in self.magnetic_signals:
@@ -455,6 +509,19 @@ class ObjectOfInterest:
         temp_position = geom.middle_point(marker_positions)
         return temp_position
 
+    def last_step(self, lookback=STEP_LOOKBACK):
+        """ Last known position before the current one and the time in ms
+        between both, (None, None) if there is none within lookback frames.
+        """
+        if self.position is None:
+            return None, None
+        dt = 0
+        for k in xrange(len(self.pos_hist) - 2, max(-1, len(self.pos_hist) - 2 - lookback), -1):
+            dt += self.time_hist[k + 1] if k + 1 < len(self.time_hist) else 0
+            if self.pos_hist[k] is not None:
+                return self.pos_hist[k], dt
+        return None, None
+
     @property
     def position(self):
         """Return last position."""
@@ -621,6 +688,8 @@ class fpsTestSignal:
     def __init__(self, pin):
         self.even_frame = True
         self.slot = Slot('fpstest', 'digital', self.flipstate, self)
+        # flips every frame, would flood the event log
+        self.slot.logged = False
 
     def attach_pin(self, pin):
         self.slot.attach_pin(pin)
@@ -632,6 +701,43 @@ class fpsTestSignal:
         self.even_frame = not self.even_frame
         return self.even_frame
 
+class RegionStats:
+    """ Running counters of one object in one region: entries, exits, time
+    spent inside (ms) and tickstamp of the last entry. Line crossings and
+    frames without a position leave the inside state as it is, same as the
+    event log, time keeps counting while inside.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.inside = False
+        self.entries = 0
+        self.exits = 0
+        self.dwell = 0.0
+        self.last_entry = None
+
+    def update(self, inside, dt=0, tickstamp=None):
+        """ inside: True, False or None if unknown this frame. dt is the
+        time since the previous frame in ms.
+        """
+        if self.inside and dt:
+            self.dwell += dt
+        if inside is None or inside == self.inside:
+            return
+        if inside:
+            self.entries += 1
+            self.last_entry = tickstamp
+        else:
+            self.exits += 1
+        self.inside = inside
+
+    def as_dict(self):
+        return {'inside': self.inside, 'entries': self.entries, 'exits': self.exits,
+                'dwell': self.dwell, 'last_entry': self.last_entry}
+
+
 class RegionOfInterest:
     """ Region in image registered objects are tested against.
     If trackables are occupying or intersecting, trigger their specific
@@ -661,21 +767,47 @@ class RegionOfInterest:
         self.slots = []
         # reference to all objects spotter holds
         self.oois = obj_list
+        # collision results of the current frame, by object
+        self.collisions = {}
+        # shape each object collided with in the current frame, or None
+        self.hits = {}
+        self.hit_shape = None
+        # line crossings of the current frame, object -> (fraction of the
+        # movement at the crossing, duration of the movement in ms)
+        self.crossings = {}
+        # RegionStats of every object, kept over the session
+        self.stats = {}
         # The slots for these objects are trying to automatically link pins
         if magnetic_objects is None:
             self.magnetic_objects = []
         else:
             self.magnetic_objects = magnetic_objects
 
+        # spatial index of the tracker, registers the shapes when attached
+        self.index = None
+
         # if initialized with starting set of shapes
         self.shapes = []
         if shape_list:
             for shape in shape_list:
                 self.add_shape(*shape)
 
+    def attach_index(self, index):
+        """ Register all shapes in a gridindex.GridIndex, and later added
+        ones as they come.
+        """
+        self.index = index
+        for s in self.shapes:
+            index.insert(s, self)
+
+    def detach_index(self):
+        if self.index is not None:
+            for s in self.shapes:
+                self.index.remove(s)
+        self.index = None
+
     def update_state(self):
         self.highlighted = False
-        self.deal_pin_prefs()
 
     def deal_pin_prefs(self):
         for mo in self.magnetic_objects:
@@ -721,12 +853,16 @@ class RegionOfInterest:
         """ Adds a new shape. """
         shape = Shape(shape_type, points, label)
         self.shapes.append(shape)
+        if self.index is not None:
+            self.index.insert(shape, self)
         return shape
 
     def remove_shape(self, shape):
         """ Removes a shape. """
         try:
             self.shapes.remove(shape)
+            if self.index is not None:
+                self.index.remove(shape)
         except ValueError:
             print "Couldn't find shape for removal"
 
@@ -754,25 +890,86 @@ class RegionOfInterest:
                                    state_idx=obj, ref=obj))
 
     def unlink_object(self, obj):
+        self.stats.pop(obj, None)
         for slot in self.slots:
             if slot.ref is obj:
                 self.slots.remove(slot)
                 print "Removed object", obj.label, "from slot list of", self.label
 
-    def test_collision(self, obj):
-        return self.check_shape_collision(obj.position)
+    def update_collisions(self, region_map=None, index=None, frame=None):
+        """ Test all objects against the shapes once per frame. Slots and
+        recording triggers read the cached result via test_collision, so
+        stateful checks like line crossings are only evaluated once.
+        With a located regionmap.RegionMap area shapes are looked up instead
+        of tested one by one, with a located gridindex.GridIndex only the
+        shapes near each object are tested. The frame's interval and
+        tickstamp advance the RegionStats of the objects.
+        """
+        self.collisions = {}
+        self.hits = {}
+        self.crossings = {}
+        if self.oois:
+            for o in self.oois:
+                shapes = None if index is None else index.near(o, self)
+                if shapes is not None and not shapes:
+                    # no shape of this region anywhere near
+                    self.collisions[o] = None if o.position is None else False
+                    self.hits[o] = None
+                else:
+                    previous, dt = o.last_step()
+                    self.collisions[o] = self.check_shape_collision(o.position, previous, region_map, o, shapes)
+                    self.hits[o] = self.hit_shape
+                    if self.hit_shape is not None and self.hit_shape.shape == 'line':
+                        self.crossings[o] = (self.hit_shape.crossing, dt)
+                if frame is not None:
+                    self.update_stats(o, frame)
+        self.toggle_highlight()
+
+    def update_stats(self, obj, frame):
+        """ Advance the counters of obj by the collision result of frame. """
+        stats = self.stats.get(obj)
+        if stats is None:
+            stats = self.stats[obj] = RegionStats()
+        collision, hit = self.collisions.get(obj), self.hits.get(obj)
+        if collision is None or (hit is not None and hit.shape == 'line'):
+            inside = None
+        else:
+            inside = collision
+        stats.update(inside, frame.interval, frame.tickstamp)
+
+    def get_stats(self, obj):
+        """ RegionStats of obj, None if it was never tested. """
+        return self.stats.get(obj)
 
-    def check_shape_collision(self, point1, point2=None):
-        """ Test if a line between start and end would somewhere collide with
-        any shapes of this ROI. Simple AND values in the collision detection
-        array on the line.
+    def reset_stats(self):
+        self.stats = {}
+
+    def test_collision(self, obj):
+        if obj in self.collisions:
+            return self.collisions[obj]
+        return self.check_shape_collision(obj.position, obj.last_step()[0])
+
+    def check_shape_collision(self, point1, point2=None, region_map=None, obj=None, shapes=None):
+        """ Test if point1 collides with any shapes of this ROI. Lines are
+        crossed if the movement from the previous position point2 to point1
+        intersects them. shapes restricts the test to candidates, e.g. from
+        the spatial index.
         """
-        # TODO: Only checks of the point is within the bounding box of shapes?
+        self.hit_shape = None
         if point1 is not None:
             collision = False
-            for s in self.shapes:
-                if s.active and s.collision_check(point1):
+            for s in (self.shapes if shapes is None else shapes):
+                if not s.active:
+                    continue
+                inside = None if region_map is None else region_map.contains(s, obj)
+                if inside is None:
+                    if s.shape == 'line':
+                        inside = s.collision_check_line(point1, point2)
+                    else:
+                        inside = s.collision_check(point1)
+                if inside:
                     self.highlighted = True
+                    self.hit_shape = s
                     collision = True
                     break
 
@@ -31,6 +31,8 @@ import math
 import lib.utilities as utils
 import lib.geometry as geom
 import trackables as trkbl
+import regionmap
+import gridindex
 from lib.docopt import docopt
 
 DEBUG = False #True
@@ -72,6 +74,10 @@ class Tracker:
         self.leds = [] #markers
         self.bspots= [] #blind spots
         self.adaptive_tracking = adaptive_tracking
+        # rasterized area shapes of all regions, redrawn on edits
+        self.region_map = regionmap.RegionMap()
+        # grid of shapes near every position, updated on edits
+        self.shape_index = gridindex.GridIndex()
 
     def add_blindspot(self, mask_list, label):
         #mask = trkbl.Mask('rectangle', None, 'label')
@@ -129,17 +135,28 @@ class Tracker:
 
     def add_roi(self, shape_list, label, color=None, magnetic_objects=None):
         roi = trkbl.RegionOfInterest(shape_list, label, color, self.oois, magnetic_objects)
+        roi.attach_index(self.shape_index)
         self.rois.append(roi)
         self.log.debug("Added region %s", roi)
         return roi
 
     def remove_roi(self, roi):
         try:
+            roi.detach_index()
             del roi.shapes[:]
             self.rois.remove(roi)
         except ValueError:
             self.log.error("Region to be removed not found")
 
+    def locate_objects(self, frame):
+        """ Look up all objects in the region map, redrawing it first if
+        regions were edited, and collect the shapes near them.
+        """
+        self.region_map.update(self.rois, frame.img.shape[:2])
+        self.region_map.locate(self.oois)
+        self.shape_index.locate(self.oois)
+        return self.region_map, self.shape_index
+
     def trackFPS(self, pin):
         f=trkbl.fpsTestSignal(pin)
         return f
@@ -157,6 +174,8 @@ class Tracker:
                     cv2.rectangle(frame.img, m.p1, m.p2, (0, 0, 0), -1)
                 if m.shape== 'circle' and m.active:
                     cv2.circle(frame.img, m.p1, m.radius, (0, 0, 0), -1)
+                if m.shape== 'polygon' and m.active:
+                    cv2.fillPoly(frame.img, [m.contour], (0, 0, 0))
         return frame
 
     def track_marker(self, frame, method='hsv_thresh', scale=1.0, elapsedtime=5):
@@ -33,12 +33,22 @@ import logging
 
 from lib import utilities as utils
 from lib.docopt import docopt
+import sidecar
+import overlay
 
 OVERWRITE = False
-#seconds till writer process times out after having received last alive packet
+#seconds till writer process times out after the heartbeat counter stopped changing
 
 STILL_ALIVE_TIMEOUT = 10
 
+# recordings start and stop through the frame queue, in order with the frames:
+# [START, size, destination, labels] opens a recording, STOP follows its last frame
+START = 'start'
+STOP = 'stop'
+
+# burnt into each written frame: 'text' (timestamp), 'code' (frame index barcode), 'both' or None
+FRAME_STAMP = 'text'
+
 class Logger:
     destination = None
     ts_last = time.clock()
@@ -74,14 +84,21 @@ class Writer:
     alive = True
     recording = False
     ts_last = time.clock()
-    video_logger = None
+    sidecar = None
+    timestamp = None
+    frame_code = None
 
-    def __init__(self, fps=None, size=None, queue=None, pipe=None, *args, **kwargs):
+    def __init__(self, fps=None, size=None, queue=None, pipe=None, heartbeat=None, *args, **kwargs):
         logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         self.log = logging.getLogger(__name__)
         self.queue = queue
         self.pipe = pipe
 
+        # shared counter the main process increments every frame instead
+        # of sending 'alive' messages through the pipe
+        self.heartbeat = heartbeat
+        self.last_beat = heartbeat.value if heartbeat is not None else None
+
         # Only important if lower than what camera can provide, or for videos
         try:
             fps = float(29.97 if not fps else fps)
@@ -101,6 +118,10 @@ class Writer:
 
     def start(self, parameters):
         print ("start: doesn't even enter here??")# dst=None, size=None
+        # a recording still open ends before the next one starts
+        if self.writer is not None or self.sidecar is not None:
+            self.stop()
+            self.close()
         if len(parameters) >= 1:
             size = parameters[1]
             if size is None:
@@ -112,6 +133,9 @@ class Writer:
         if len(parameters) >= 2:
             dst = parameters[2]
 
+        # object and LED labels of the per-frame sidecar records
+        labels = parameters[3] if len(parameters) >= 4 else ([], [])
+
         # check if output file exists
         if dst is None:
             dst = 'recordings/' + utils.time_string() + '.avi'
@@ -129,14 +153,16 @@ class Writer:
         self.writer = cv2.VideoWriter(filename=self.destination, fourcc=cv2.cv.CV_FOURCC(cc[0], cc[1], cc[2], cc[3]),
                                       fps=self.fps, frameSize=self.size, isColor=True)
 
-        self.video_logger = logging.getLogger(destination)
-        self.video_logger.handlers = []
-        self.video_logger.addHandler(logging.FileHandler(''.join([destination, '.log'])))
-        self.video_logger.setLevel(logging.INFO)
-        self.video_logger.propagate = False
+        self.sidecar = sidecar.SidecarWriter(''.join([destination, sidecar.EXTENSION]), labels,
+                                             fps=self.fps, size=self.size, codec=self.codec,
+                                             destination=self.destination, started=utils.time_string())
 
-        self.video_logger.info('Start recording: %s fps, %s, %s, %s',
-                               str(self.fps), str(self.size), self.codec, self.destination)
+        if FRAME_STAMP in ('text', 'both'):
+            self.timestamp = overlay.TimestampOverlay()
+        if FRAME_STAMP in ('code', 'both'):
+            code = overlay.FrameCode()
+            code.y = self.size[1] - code.cell
+            self.frame_code = code
 
         self.log.debug('Recording running...')
         self.recording = True
@@ -144,14 +170,7 @@ class Writer:
     def stop(self):
         print ("stop: doesn't even enter here??")
         self.destination = None
-        if self.video_logger is not None:
-            for handle in self.video_logger.handlers:
-                self.log.debug("Flushing video logger file handle of %s", str(handle))
-                handle.flush()
-                if isinstance(handle, logging.FileHandler):
-                    self.log.debug("Closing video logger file handle of %s", str(handle))
-                    handle.close()
-            self.video_logger = None
+        self.close_sidecar()
 
         if self.recording:
             self.close()
@@ -160,7 +179,7 @@ class Writer:
     def write(self, item):
         # TODO: Error handling of frame existence/content
         frame = item[0]
-        messages = item[1]
+        record = item[1]
 
         try:
             assert self.size == (frame.img.shape[1], frame.img.shape[0])
@@ -169,12 +188,13 @@ class Writer:
             self.log.debug('Frame shape: %s, expected: %s', str(frame.img.shape), str(self.size))
             self.stop()
 
-        for m in messages:
-            self.video_logger.info(m)
+        if self.sidecar is not None and record is not None:
+            self.sidecar.append(record)
 
-        cv2.putText(img=frame.img, text=frame.time_text,
-                    org=(15, 20), fontFace=cv2.FONT_HERSHEY_PLAIN, fontScale=1.6,
-                    color=(250, 250, 50), thickness=1, lineType=cv2.CV_AA)
+        if self.timestamp is not None:
+            self.timestamp.draw(frame.img, frame.time_text)
+        if self.frame_code is not None:
+            self.frame_code.draw(frame.img, frame.index)
         self.writer.write(frame.img)
 
     def loop(self):
@@ -183,7 +203,10 @@ class Writer:
         """
         # FIXME: The interface initialization can take longer than the timeout on the writer!
         while 42 and self.alive:
-            # Process should terminate if not being talked to for a while
+            # Process should terminate if the main process stopped beating for a while
+            if self.heartbeat is not None and self.heartbeat.value != self.last_beat:
+                self.last_beat = self.heartbeat.value
+                self.ts_last = time.clock()
             #self.log.debug("Alive signal timeout: %s", str(time.clock() - self.ts_last))
             if time.clock() - self.ts_last > STILL_ALIVE_TIMEOUT:
                 print "wtfffffffffffffffffff"
@@ -216,13 +239,16 @@ class Writer:
                 elif cmd == 'start':
                     self.log.debug('Writer received start signal with parameters: %s', str(msg))
                     self.start(msg)
-                elif cmd == 'alive':
-                    pass
 
             while not self.queue.empty():
                 item = self.queue.get()
-
-                if self.writer and self.recording:
+                if item == STOP:
+                    self.log.debug('Writer reached end of recording')
+                    self.stop()
+                elif item[0] == START:
+                    self.log.debug('Writer starts recording with parameters: %s', str(item))
+                    self.start(item)
+                elif self.writer and self.recording:
                     self.write(item)
 
             # refresh time to keep CPU utilization down
@@ -232,9 +258,16 @@ class Writer:
         if not self.alive:
             self.close()
 
+    def close_sidecar(self):
+        if self.sidecar is not None:
+            self.log.debug("Closing sidecar %s", self.sidecar.path)
+            self.sidecar.close()
+            self.sidecar = None
+
     def close(self):
         self.log.debug('Closing writer')
         print ("closing works?")
+        self.close_sidecar()
         if self.writer is not None:
             #self.queue.empty()
             del self.writer
@@ -183,6 +183,25 @@ def seg_intersect(a1, a2, b1, b2):
         return (num / denom)*db + b1
 
 
+def segment_crossing(p1, p2, q1, q2):
+    """ Fraction of the way from p1 to p2 at which the segment crosses the
+    segment q1-q2, None if it does not. Touching at p1 does not count, at p2
+    it does, so a movement ending on a line is counted once.
+    """
+    dx, dy = p2[0] - p1[0], p2[1] - p1[1]
+    ex, ey = q2[0] - q1[0], q2[1] - q1[1]
+    denom = dx * ey - dy * ex
+    if denom == 0:
+        # parallel, or no movement
+        return None
+    fx, fy = q1[0] - p1[0], q1[1] - p1[1]
+    t = (fx * ey - fy * ex) / float(denom)
+    u = (fx * dy - fy * dx) / float(denom)
+    if 0 < t <= 1 and 0 <= u <= 1:
+        return t
+    return None
+
+
 def point_in_poly(point, poly):
     """Improved point in polygon test which includes edge and vertex points
     From: http://geospatialpython.com/2011/08/point-in-polygon-2-on-line.html
@@ -224,6 +243,66 @@ def point_in_poly(point, poly):
     return inside
 
 
+class Polygon:
+    """ Edge table of a closed polygon for repeated point-in-polygon tests.
+    Even-odd rule, a point exactly on the right or bottom border is outside.
+    Edge slopes and the bounding box are computed once, tests are numpy
+    operations over all edges (and points) at once.
+    """
+
+    def __init__(self, vertices):
+        v = np.asarray(vertices, float).reshape(-1, 2)
+        if len(v) < 3:
+            raise ValueError("Polygon needs at least 3 vertices")
+        self.vertices = v
+        w = np.roll(v, -1, axis=0)
+        # only edges crossing a horizontal line can change the parity
+        crossing = v[:, 1] != w[:, 1]
+        self.x0, self.y0 = v[crossing, 0], v[crossing, 1]
+        self.y1 = w[crossing, 1]
+        self.dxdy = (w[crossing, 0] - self.x0) / (self.y1 - self.y0)
+        self.xmin, self.ymin = v.min(axis=0)
+        self.xmax, self.ymax = v.max(axis=0)
+
+    def intersections(self, y):
+        """ x of the edges crossing the horizontal line at y, sorted. """
+        edges = (self.y0 > y) != (self.y1 > y)
+        return np.sort(self.x0[edges] + (y - self.y0[edges]) * self.dxdy[edges])
+
+    def contains_point(self, point):
+        x, y = point[0], point[1]
+        if x < self.xmin or x > self.xmax or y < self.ymin or y > self.ymax:
+            return False
+        return bool(np.count_nonzero(self.intersections(y) > x) % 2)
+
+    def contains(self, points):
+        """ Boolean array, True for each (x, y) of points inside. """
+        p = np.asarray(points, float).reshape(-1, 2)
+        x, y = p[:, :1], p[:, 1:]
+        inside = (p[:, 0] >= self.xmin) & (p[:, 0] <= self.xmax) & \
+                 (p[:, 1] >= self.ymin) & (p[:, 1] <= self.ymax)
+        if not inside.any():
+            return inside
+        x, y = x[inside], y[inside]
+        edges = (self.y0 > y) != (self.y1 > y)
+        right = x < self.x0 + (y - self.y0) * self.dxdy
+        inside[inside] = np.logical_xor.reduce(edges & right, axis=1)
+        return inside
+
+    def raster(self, y0, y1, x0, x1):
+        """ Boolean image of the pixels [y0:y1, x0:x1] inside, one scanline
+        at a time. Same rule as contains for the pixel coordinates.
+        """
+        xs = np.arange(x0, x1)
+        out = np.zeros((y1 - y0, x1 - x0), bool)
+        for row, y in enumerate(xrange(y0, y1)):
+            xints = self.intersections(y)
+            if len(xints):
+                # number of intersections right of each pixel
+                out[row] = (len(xints) - np.searchsorted(xints, xs, 'right')) % 2 == 1
+        return out
+
+
 if __name__ == "__main__":
     pass
     #a = np.array( [0.0, 0.0] )
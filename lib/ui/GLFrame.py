@@ -13,6 +13,7 @@ import OpenGL.arrays.vbo as glvbo
 import math
 import numpy as np
 import lib.geometry as geom
+from lib.core import overlay
 import cv2
 
 
@@ -42,6 +43,11 @@ class GLFrame(QtOpenGL.QGLWidget):
 
         self.jobs = []
         self.spotter = None
+        self.timestamp = overlay.TimestampOverlay(line_type=8)
+
+        # video texture, (width, height, format) it was allocated for
+        self.texture = None
+        self.texture_key = None
 
     def update_world(self, spotter):
         if spotter is None:
@@ -96,6 +102,8 @@ class GLFrame(QtOpenGL.QGLWidget):
                         self.jobs.append([self.drawCircle, s.points, color])
                     elif s.shape == "line":
                         self.jobs.append([self.drawLine, s.points, color])
+                    elif s.shape == "polygon":
+                        self.jobs.append([self.drawPolygon, s.points, color])
 
         self.updateGL()
 
@@ -140,18 +148,24 @@ class GLFrame(QtOpenGL.QGLWidget):
                 cv2.putText(img=self.frame.img, text="GUI turned off",
                             org=(15, 20), fontFace=cv2.FONT_HERSHEY_PLAIN, fontScale=1.6,
                             color=(250, 250, 50), thickness=1, lineType=cv2.CV_AA)
+                img = self.frame.img
             else:
+                img = self.frame.img
+                heatmaps = [o.occupancy for o in self.spotter.tracker.oois
+                            if o.show_occupancy and o.occupancy is not None]
+                if heatmaps:
+                    # blended, so a repaint of the same frame must not stack them
+                    img = img.copy()
+                    for m in heatmaps:
+                        m.draw(img)
                 if self.frame.source_type == 'device':
-                    cv2.putText(img=self.frame.img, text=self.frame.time_text,
-                                org=(15, 20), fontFace=cv2.FONT_HERSHEY_PLAIN, fontScale=1.6,
-                                color=(250, 250, 50), thickness=1)
+                    self.timestamp.draw(img, self.frame.time_text)
                     #self.frame.img = cv2.cvtColor(self.frame.img, cv2.COLOR_BGR2HSV)  #for display
                     #contours, hierarchy = cv2.findContours(self.frame.img, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
                    # cv2.drawContours(self.frame.img, self.spotter.tracker.contour, -1, (0, 255, 0), 3)
-            shape = self.frame.img.shape
                 # TODO: Flags for horizontal/vertical flipping
-            GL.glDrawPixels(shape[1], shape[0], GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
-                            np.fliplr(self.frame.img).tostring()[::-1])
+            self.upload_frame(img)
+            self.drawFrame()
 
         color = (0.5, 0.5, 0.5, 0.5)
         if self.dragging:
@@ -186,6 +200,54 @@ class GLFrame(QtOpenGL.QGLWidget):
             draw_func = j[0]
             draw_func(*j[1:])
 
+    def upload_frame(self, img):
+        """ Copy the frame into the video texture. The array is handed to GL
+        as it is, BGR rows top to bottom, the texture is only reallocated
+        when the frame size changes.
+        """
+        if img.ndim == 3:
+            fmt, internal = GL.GL_BGR, GL.GL_RGB
+        else:
+            fmt, internal = GL.GL_LUMINANCE, GL.GL_LUMINANCE
+        if not img.flags['C_CONTIGUOUS']:
+            img = np.ascontiguousarray(img)
+        h, w = img.shape[:2]
+
+        if self.texture is None:
+            self.texture = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        # rows of BGR frames are not padded to 4 bytes
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        if self.texture_key != (w, h, fmt):
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, internal, w, h, 0, fmt, GL.GL_UNSIGNED_BYTE, None)
+            self.texture_key = (w, h, fmt)
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0, w, h, fmt, GL.GL_UNSIGNED_BYTE, img)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+    def drawFrame(self):
+        """ Draws the video texture over the whole frame. The first row of
+        the texture is the top of the image, as is y=0.
+        """
+        GL.glEnable(GL.GL_TEXTURE_2D)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glTexEnvi(GL.GL_TEXTURE_ENV, GL.GL_TEXTURE_ENV_MODE, GL.GL_REPLACE)
+        GL.glBegin(GL.GL_QUADS)
+        GL.glTexCoord2f(0, 0)
+        GL.glVertex2f(0, 0)
+        GL.glTexCoord2f(1, 0)
+        GL.glVertex2f(1, 0)
+        GL.glTexCoord2f(1, 1)
+        GL.glVertex2f(1, 1)
+        GL.glTexCoord2f(0, 1)
+        GL.glVertex2f(0, 1)
+        GL.glEnd()
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        GL.glDisable(GL.GL_TEXTURE_2D)
+
     def resizeGL(self, width, height):
         """ Resize frame when widget is being resized. """
         self.width = width
@@ -301,6 +363,33 @@ class GLFrame(QtOpenGL.QGLWidget):
         GL.glRectf(points[0][0]*1.0/self.width, points[0][1]*1.0/self.height,
                    points[1][0]*1.0/self.width, points[1][1]*1.0/self.height)
 
+    def drawPolygon(self, points, color):
+        """ Draws a filled, possibly concave polygon. The stencil buffer
+        marks the pixels covered an odd number of times by a triangle fan
+        over the vertices, only those are filled.
+        """
+        vertices = [(p[0]*1.0/self.width, p[1]*1.0/self.height) for p in points]
+
+        GL.glEnable(GL.GL_STENCIL_TEST)
+        GL.glClear(GL.GL_STENCIL_BUFFER_BIT)
+        GL.glColorMask(GL.GL_FALSE, GL.GL_FALSE, GL.GL_FALSE, GL.GL_FALSE)
+        GL.glStencilFunc(GL.GL_ALWAYS, 0, 1)
+        GL.glStencilOp(GL.GL_KEEP, GL.GL_KEEP, GL.GL_INVERT)
+        GL.glBegin(GL.GL_TRIANGLE_FAN)
+        for v in vertices:
+            GL.glVertex2f(*v)
+        GL.glEnd()
+
+        GL.glColorMask(GL.GL_TRUE, GL.GL_TRUE, GL.GL_TRUE, GL.GL_TRUE)
+        GL.glStencilFunc(GL.GL_EQUAL, 1, 1)
+        GL.glStencilOp(GL.GL_KEEP, GL.GL_KEEP, GL.GL_ZERO)
+        GL.glColor(*color)
+        GL.glBegin(GL.GL_TRIANGLE_FAN)
+        for v in vertices:
+            GL.glVertex2f(*v)
+        GL.glEnd()
+        GL.glDisable(GL.GL_STENCIL_TEST)
+
     def drawBox(self, points, color):
         if points is None:
             return
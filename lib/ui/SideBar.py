@@ -25,6 +25,17 @@ import TabSerial
 import numpy as np
 
 
+def template_points(shape):
+    """ Points of a shape or mask template: p1 and p2, or the vertex list
+    for polygons. None for polygons with fewer than three vertices.
+    """
+    if shape['type'] == 'polygon':
+        v = shape.get('points') or []
+        vertices = [[v[i], v[i+1]] for i in xrange(0, len(v) - 1, 2)]
+        return vertices if len(vertices) >= 3 else None
+    return [shape['p1'], shape['p2']]
+
+
 class SideBar(QtGui.QWidget, Ui_side_bar):
 
     def __init__(self, parent, *args, **kwargs):
@@ -300,13 +311,13 @@ class SideBar(QtGui.QWidget, Ui_side_bar):
         for s_key in template['shapes']:
             if s_key in shapes:
                 shape_type = shapes[s_key]['type']
-                if abs_pos:
-                    points = [shapes[s_key]['p1'], shapes[s_key]['p2']]
-                else:
-                    points = geom.scale_points([shapes[s_key]['p1'],
-                                                shapes[s_key]['p2']],
-                                               (self.parent.gl_frame.width,
-                                                self.parent.gl_frame.height))
+                points = template_points(shapes[s_key])
+                if points is None:
+                    self.log.warning("Skipping shape %s, polygon needs at least 3 points", s_key)
+                    continue
+                if not abs_pos:
+                    points = geom.scale_points(points, (self.parent.gl_frame.width,
+                                                        self.parent.gl_frame.height))
                 shape_list.append([shape_type, points, s_key])
 
         # Magnetic objects from collision list
@@ -399,13 +410,13 @@ class SideBar(QtGui.QWidget, Ui_side_bar):
         for s_key in template['masks']:
              if s_key in masks:
                 mask_type = masks[s_key]['type']
-                if abs_pos:
-                     points = [masks[s_key]['p1'], masks[s_key]['p2']]
-                else:
-                     points = geom.scale_points([masks[s_key]['p1'],
-                                                 masks[s_key]['p2']],
-                                                (self.parent.gl_frame.width,
-                                                 self.parent.gl_frame.height))
+                points = template_points(masks[s_key])
+                if points is None:
+                    self.log.warning("Skipping mask %s, polygon needs at least 3 points", s_key)
+                    continue
+                if not abs_pos:
+                    points = geom.scale_points(points, (self.parent.gl_frame.width,
+                                                        self.parent.gl_frame.height))
                 mask_list.append([mask_type, points, s_key])
 
         # color = template['color']
@@ -52,6 +52,14 @@ class Tab(QtGui.QWidget, Ui_tab_objects):
         self.ckb_FilterEnable.setEnabled(False)
         self.ckb_analog_pos.setVisible(False)
 
+        # occupancy map of the object, shown over the video or saved
+        self.ckb_heatmap = QtGui.QCheckBox("Show Heatmap", self.page_objects_tracking)
+        self.gridLayout_5.addWidget(self.ckb_heatmap, 6, 0, 1, 1)
+        self.btn_export_heatmap = QtGui.QPushButton("Export Heatmap", self.page_objects_tracking)
+        self.gridLayout_5.addWidget(self.btn_export_heatmap, 7, 0, 1, 1)
+        self.connect(self.ckb_heatmap, QtCore.SIGNAL('stateChanged(int)'), self.update_object)
+        self.connect(self.btn_export_heatmap, QtCore.SIGNAL('clicked()'), self.export_heatmap)
+
         #self.progressDist.setVisible(False)
         #self.progressDist.setMaximum(100)
 
@@ -133,6 +141,11 @@ class Tab(QtGui.QWidget, Ui_tab_objects):
         if not self.ckb_track.isChecked() == self.object.tracked:
             self.ckb_track.setChecked(self.object.tracked)
 
+        if not self.ckb_heatmap.isChecked() == self.object.show_occupancy:
+            self.ckb_heatmap.setChecked(self.object.show_occupancy)
+        self.ckb_heatmap.setEnabled(self.object.occupancy is not None)
+        self.btn_export_heatmap.setEnabled(self.object.occupancy is not None)
+
         #if not self.ckb_analog_pos.isChecked() == self.object.analog_pos:
         #    self.ckb_analog_pos.setChecked(self.object.analog_pos)
 
@@ -154,8 +167,17 @@ class Tab(QtGui.QWidget, Ui_tab_objects):
         #self.object.guessing_enabled = self.ckb_guessing.isChecked()
         self.object.tracked = self.ckb_track.isChecked()
         self.object.traced = self.ckb_trace.isChecked()
+        self.object.show_occupancy = self.ckb_heatmap.isChecked()
         #self.object.analog_pos = self.ckb_analog_pos.isChecked()
 
+    def export_heatmap(self):
+        if self.object.occupancy is None:
+            return
+        filename = str(QtGui.QFileDialog.getSaveFileName(self, 'Export Heatmap', './recordings/',
+                                                         'Occupancy (*.npz *.png)'))
+        if filename:
+            self.object.occupancy.save(filename)
+
     def process_event(self, event):
         pass
 
@@ -336,6 +336,19 @@ class Tab(QtGui.QWidget, Ui_tab_regions):
                 j = cbx.model().index(i, 0)
                 cbx.model().setData(j, QtCore.QVariant(enabled[i]), QtCore.Qt.UserRole-1)
 
+        self.refresh_stats()
+
+    def refresh_stats(self):
+        """ Entries and time inside of each object as tooltip of its row. """
+        for row in xrange(self.table_slots.rowCount()):
+            item = self.table_slots.item(row, 0)
+            stats = self.region.get_stats(self.region.slots[row].ref)
+            if item is None or stats is None:
+                continue
+            item.setToolTip("%d entries, %d exits\n%.1f s inside%s" %
+                            (stats.entries, stats.exits, stats.dwell / 1000.,
+                             ", now" if stats.inside else ""))
+
     def slot_table_changed(self):
         for i in xrange(self.table_slots.rowCount()):
             cbx = self.table_slots.cellWidget(i, 1)
@@ -61,6 +61,19 @@ class Tab(QtGui.QWidget, Ui_tab_serial):
             rx = utils.binary_prefix(self.serial.bytes_rx())
             self.lbl_bytes_sent.setText(tx)
             self.lbl_bytes_received.setText(rx)
+            stats = self.serial.output_stats()
+            if stats:
+                self.lbl_bytes_sent.setToolTip("%d writes, %d coalesced, latency %.2f ms (max %.2f ms)"
+                                               % (stats['n_sends'], stats['n_coalesced'],
+                                                  stats['latency_mean'] * 1000, stats['latency_max'] * 1000))
+            timing = self.serial.scheduler_stats()
+            if timing:
+                self.lbl_bytes_received.setToolTip("output %.1f Hz, jitter %.3f +- %.3f ms (max %.3f ms), %d missed"
+                                                   % (timing['rate'], timing['jitter_mean'] * 1000,
+                                                      timing['jitter_std'] * 1000, timing['jitter_max'] * 1000,
+                                                      timing['n_missed']))
+        elif self.serial.is_connecting():
+            self.btn_serial_connect.setText('Connecting...')
         else:
             self.btn_serial_connect.setText('Connect')
             self.btn_serial_connect.setChecked(False)
@@ -112,6 +112,9 @@ class Ui_MainWindow(object):
         icon5.addPixmap(QtGui.QPixmap(_fromUtf8(":/stop_file.png")), QtGui.QIcon.Normal, QtGui.QIcon.On)
         self.actionRecord.setIcon(icon5)
         self.actionRecord.setObjectName(_fromUtf8("actionRecord"))
+        self.actionTriggered = QtGui.QAction(MainWindow)
+        self.actionTriggered.setCheckable(True)
+        self.actionTriggered.setObjectName(_fromUtf8("actionTriggered"))
         self.actionArduino = QtGui.QAction(MainWindow)
         self.actionArduino.setEnabled(False)
         icon6 = QtGui.QIcon()
@@ -185,6 +188,7 @@ class Ui_MainWindow(object):
         self.toolBar.addAction(self.actionCamera)
         self.toolBar.addAction(self.actionFile)
         self.toolBar.addAction(self.actionRecord)
+        self.toolBar.addAction(self.actionTriggered)
         self.toolBar.addSeparator()
         self.toolBar.addAction(self.actionGUI_on_off)
         self.toolBar.addAction(self.actionFPS_test)
@@ -220,6 +224,8 @@ class Ui_MainWindow(object):
         self.actionAbout.setText(_translate("MainWindow", "&About", None))
         self.actionRecord.setText(_translate("MainWindow", "Record", None))
         self.actionRecord.setToolTip(_translate("MainWindow", "Record Video", None))
+        self.actionTriggered.setText(_translate("MainWindow", "Triggered", None))
+        self.actionTriggered.setToolTip(_translate("MainWindow", "Record only around objects entering regions", None))
         self.actionArduino.setText(_translate("MainWindow", "Arduino", None))
         self.actionArduino.setToolTip(_translate("MainWindow", "Arduino State", None))
         self.actionLoadConfig.setText(_translate("MainWindow", "Load", None))
@@ -202,6 +202,11 @@ class Main(QtGui.QMainWindow):
     def spotterUpdate(self):
         if self.spotter.update() is None:
             return
+        # boards connect in the background, attach the FPS pin once one is up
+        # and again whenever its pin is no longer one of the connected boards
+        if self.ui.actionFPS_test.isChecked() and self.spotter.chatter.connected \
+                and self.spotter.fpstest.slot.pin not in self.spotter.chatter.pins('digital'):
+            self.trackFPS(True)
         if self.spotter.spotterelapsed>0:
             self.avg_fps = self.avg_fps * 0.95 + 0.05 * 1000. / self.spotter.spotterelapsed
         else:
@@ -311,12 +316,12 @@ class Main(QtGui.QMainWindow):
 
 
     def start_log(self, state, filename=None):
-        """ Writes a log file in txt with timestamps and locations"""
+        """ Writes a log file with timestamps and locations"""
         if state:
             if filename is None:
                 filename = QtGui.QFileDialog.getSaveFileName(self, 'Open Folder', './recordings/')
             if len(filename):
-                self.spotter.start_datalog(str(filename) + '.txt')
+                self.spotter.start_datalog(str(filename) + self.spotter.datalog_extension)
             else:
                 return
         else:
@@ -331,9 +336,13 @@ class Main(QtGui.QMainWindow):
             if filename is None:
                 filename = QtGui.QFileDialog.getSaveFileName(self, 'Open Video', './recordings/')
                 if len(filename):
-                    self.spotter.start_writer(str(filename)+'.avi')
+                    self.spotter.start_writer(str(filename)+'.avi',
+                                              triggered=self.ui.actionTriggered.isChecked())
+                    # mode is fixed for the duration of the recording
+                    self.ui.actionTriggered.setEnabled(False)
         else:
             self.spotter.stop_writer()
+            self.ui.actionTriggered.setEnabled(True)
 
     def mouse_event_to_tab(self, event_type, event):
         """
@@ -586,6 +595,8 @@ class Main(QtGui.QMainWindow):
             section = {'p1': s.points[0],
                        'p2': s.points[1],
                        'type': s.shape}
+            if s.shape == 'polygon':
+                section['points'] = [c for p in s.points for c in p[:2]]
             # if one would store the points normalized instead of absolute
             # But that would require setting the flag in TEMPLATES section
             #section = {'p1': geom.norm_points(s.points[0], rng),
@@ -605,6 +616,8 @@ class Main(QtGui.QMainWindow):
             section = {'p1': m.points[0],
                        'p2': m.points[1],
                        'type': m.shape}
+            if m.shape == 'polygon':
+                section['points'] = [c for p in m.points for c in p[:2]]
             # if one would store the points normalized instead of absolute
             # But that would require setting the flag in TEMPLATES section
             # section = {'p1': geom.norm_points(s.points[0], rng),